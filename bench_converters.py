@@ -0,0 +1,251 @@
+import json
+import os
+import platform
+import subprocess
+import sys,getopt
+import time
+from synth_shopify import parse_count
+from sku_routes import load_sku_routes
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(".3pl_cache", "bench")
+BENCH_SIZES = [1000, 10000, 100000, 1000000]
+# the export the cold start runs convert, about what a quick "just the new orders" run sees
+COLD_START_LINE_ITEMS = 5
+# a size/converter/mode that got this much slower (or fatter) than in the --compare run is flagged
+REGRESSION_THRESHOLD = 0.10
+converters = {
+        'verde': ['shopify2verde.py', '-v', os.path.join(HERE, 'verde_template.xlsx')],
+        'jd': ['shopify2jd.py', '-j', os.path.join(HERE, 'jd_template_v2.xlsx')],
+        }
+# seconds it takes from a cold start to the converter being imported / having converted a tiny export
+COLD_START_METRICS = ['python_s', 'import_s', 'convert_s']
+
+def print_help():
+    help_str=' python bench_converters.py [--sizes=1k,10k,100k,1m] [--converters=verde,jd] [--modes=all,mats,...] [--repeat=N] [--stream] [--cache] [-o FNAME_RESULTS] [--compare=FNAME_RESULTS] \n\
+            Runs shopify2verde.py and shopify2jd.py on made up shopify exports (see synth_shopify.py) of each size, once per -o mode, and records the wall time, line items per second and peak RSS of every run. Each converter gets one untimed run first (per size with --cache), so no timed run pays for filling the caches. Then the cold start of each converter: how long a bare python takes to start, how long it takes to start and import the converter, and how long converting a %d line item export takes, each in a fresh process.\n\
+            --sizes=SIZES  comma separated line item counts (default 1k,10k,100k,1m). The exports are generated once and kept in .3pl_cache/bench/\n\
+            --converters=NAMES  "verde" and/or "jd" (default both)\n\
+            --modes=MODES  "all" (no -o) and/or any mode in sku_routes.csv (default all of them)\n\
+            --repeat=N  run everything N times and keep the fastest run of each (default 1)\n\
+            --stream  benchmark the converters\' --stream mode\n\
+            --cache  let the converters load the exports from their shopify cache (.3pl_cache/shopify/). By default they are run with --no-cache, so every run parses the export\n\
+            -o FNAME_RESULTS  (--out=FNAME_RESULTS) where to write the results .json (default bench_TIMESTAMP.json)\n\
+            --compare=FNAME_RESULTS  an earlier results .json. Every run (and cold start) more than %d%% slower or bigger than the same run in it is flagged as a regression, and the exit code is 1 if there are any.' % (COLD_START_LINE_ITEMS, REGRESSION_THRESHOLD*100)
+    print(help_str)
+
+def process_args(opts, args):
+    sizes = BENCH_SIZES
+    names = list(converters)
+    modes = ["all"] + load_sku_routes().modes()
+    repeat = 1
+    stream = False
+    cache = False
+    out_fname = None
+    compare_fname = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt == "--sizes":
+            sizes = [parse_count(size) for size in arg.split(",") if size.strip()]
+        elif opt == "--converters":
+            names = [name.strip() for name in arg.split(",") if name.strip()]
+        elif opt == "--modes":
+            modes = [mode.strip() for mode in arg.split(",") if mode.strip()]
+        elif opt == "--repeat":
+            repeat = int(arg)
+        elif opt == "--stream":
+            stream = True
+        elif opt == "--cache":
+            cache = True
+        elif opt in ("-o", "--out"):
+            out_fname = arg
+        elif opt == "--compare":
+            compare_fname = arg
+    return (sizes, names, modes, repeat, stream, cache, out_fname, compare_fname)
+
+def bench_export(line_items):
+    # generated once per size and seed, they take a while at 1m. in a process of its own, see run_converter()
+    fname = os.path.abspath(os.path.join(BENCH_DIR, "synth_shopify_%d.csv" % line_items))
+    if not os.path.isfile(fname):
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        print("generating " + fname)
+        subprocess.run([sys.executable, os.path.join(HERE, 'synth_shopify.py'), '-n', str(line_items), '-o', fname + ".tmp"], stdout=subprocess.DEVNULL, check=True)
+        os.replace(fname + ".tmp", fname)
+    return fname
+
+def run_converter(name, shopify_fname, mode, stream, work_dir, cache=False):
+    # one conversion in its own process, so its peak RSS is its own. wait4() gives the rusage of just that child.
+    # on linux a child's ru_maxrss starts out at the RSS its parent had when it forked, so this script never imports
+    # pandas or builds an export itself: it stays at the size of a bare python, below any converter run.
+    cmd = [sys.executable, os.path.join(HERE, converters[name][0])] + converters[name][1:] + ['-s', shopify_fname, '--no-index']
+    if mode != "all":
+        cmd += ['-o', mode]
+    if stream:
+        cmd.append('--stream')
+    if not cache:
+        cmd.append('--no-cache')
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        print("FAILED: " + " ".join(cmd) + "\n" + stderr.decode(errors='replace')[-2000:])
+    # ru_maxrss is in KB on linux and in bytes on macs
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return wall, peak_rss, proc.returncode
+
+def remove_outputs(work_dir):
+    # the converters' outputs are not needed, only the template cache in work_dir is
+    for fname in os.listdir(work_dir):
+        if fname.startswith(("verde_", "jd_")):
+            os.remove(os.path.join(work_dir, fname))
+
+def bench(sizes, names, modes, repeat=1, stream=False, cache=False):
+    work_dir = os.path.abspath(os.path.join(BENCH_DIR, "work"))
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    warmed_up = set()
+    for line_items in sizes:
+        shopify_fname = bench_export(line_items)
+        for name in names:
+            # one untimed run first, so the first timed one doesn't also fill the template cache (and with --cache,
+            # the shopify cache for this export) that all the others load from
+            if cache or name not in warmed_up:
+                run_converter(name, shopify_fname, "all", stream, work_dir, cache)
+                remove_outputs(work_dir)
+                warmed_up.add(name)
+            for mode in modes:
+                runs = [run_converter(name, shopify_fname, mode, stream, work_dir, cache) for _ in range(repeat)]
+                wall, peak_rss, returncode = min(runs)
+                result = {
+                        'converter': name,
+                        'mode': mode,
+                        'stream': stream,
+                        'cache': cache,
+                        'line_items': line_items,
+                        'wall_s': round(wall, 4),
+                        'rows_per_s': round(line_items / wall, 1),
+                        'peak_rss_mb': round(peak_rss / 2**20, 1),
+                        'returncode': returncode,
+                        }
+                print("%-6s %-12s %8d line items  %8.2fs  %10.0f rows/s  %8.1f MB" % (name, mode, line_items, wall, result['rows_per_s'], result['peak_rss_mb']))
+                results.append(result)
+                remove_outputs(work_dir)
+    return results
+
+def time_process(cmd, work_dir):
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+def bench_cold_start(names, repeat=1, cache=False):
+    # what someone converting a handful of new orders waits for, which is mostly imports. fastest of repeat runs.
+    work_dir = os.path.abspath(os.path.join(BENCH_DIR, "work"))
+    os.makedirs(work_dir, exist_ok=True)
+    shopify_fname = bench_export(COLD_START_LINE_ITEMS)
+    python_s = min(time_process([sys.executable, '-c', 'pass'], work_dir) for _ in range(repeat))
+    results = []
+    for name in names:
+        module = os.path.splitext(converters[name][0])[0]
+        import_s = min(time_process([sys.executable, '-c', 'import sys; sys.path.insert(0, %r); import %s' % (HERE, module)], work_dir) for _ in range(repeat))
+        runs = [run_converter(name, shopify_fname, "all", False, work_dir, cache) for _ in range(repeat)]
+        wall, peak_rss, returncode = min(runs)
+        result = {
+                'converter': name,
+                'cache': cache,
+                'line_items': COLD_START_LINE_ITEMS,
+                'python_s': round(python_s, 4),
+                'import_s': round(import_s, 4),
+                'convert_s': round(wall, 4),
+                'peak_rss_mb': round(peak_rss / 2**20, 1),
+                'returncode': returncode,
+                }
+        print("%-6s cold start   %8.2fs python  %8.2fs import  %8.2fs convert %d line items  %8.1f MB" % (name, python_s, import_s, wall, COLD_START_LINE_ITEMS, result['peak_rss_mb']))
+        results.append(result)
+        remove_outputs(work_dir)
+    return results
+
+def bench_meta():
+    # only once every run is done, see run_converter()
+    import pandas as pd
+    import numpy as np
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime()),
+            'commit': commit,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            }
+
+def result_key(result):
+    return (result['converter'], result['mode'], result.get('stream', False), result.get('cache', False), result['line_items'])
+
+def compare_results(results, old_results, threshold=REGRESSION_THRESHOLD):
+    # prints every run next to the same run from an earlier results file, and returns how many got worse
+    old = {result_key(result): result for result in old_results}
+    regressions = 0
+    for result in results:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        for metric in ('wall_s', 'peak_rss_mb'):
+            change = result[metric] / before[metric] - 1 if before[metric] else 0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print("%-6s %-12s %8d line items  %-11s %10.2f -> %10.2f  (%+.0f%%)%s" % (result['converter'], result['mode'], result['line_items'], metric, before[metric], result[metric], change*100, flag))
+    return regressions
+
+def compare_cold_start(cold_start, old_cold_start, threshold=REGRESSION_THRESHOLD):
+    # compare_results() for the cold start runs
+    old = {(result['converter'], result['cache']): result for result in old_cold_start}
+    regressions = 0
+    for result in cold_start:
+        before = old.get((result['converter'], result['cache']))
+        if before is None:
+            continue
+        for metric in COLD_START_METRICS:
+            change = result[metric] / before[metric] - 1 if before[metric] else 0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print("%-6s cold start   %-11s %10.2f -> %10.2f  (%+.0f%%)%s" % (result['converter'], metric, before[metric], result[metric], change*100, flag))
+    return regressions
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"ho:",["sizes=","converters=","modes=","repeat=","stream","cache","out=","compare="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+    sizes, names, modes, repeat, stream, cache, out_fname, compare_fname = process_args(opts, args)
+
+    results = bench(sizes, names, modes, repeat, stream, cache)
+    cold_start = bench_cold_start(names, repeat, cache)
+    if out_fname is None:
+        out_fname = "bench_" + time.strftime('%m-%d_%H%M%S', time.localtime()) + ".json"
+    with open(out_fname, 'w') as f:
+        json.dump({'meta': bench_meta(), 'results': results, 'cold_start': cold_start}, f, indent=1)
+    print("wrote " + out_fname)
+
+    if compare_fname is not None:
+        with open(compare_fname) as f:
+            old = json.load(f)
+        regressions = compare_results(results, old['results'])
+        # results files from before the cold start was benchmarked have none
+        regressions += compare_cold_start(cold_start, old.get('cold_start', []))
+        if regressions:
+            print(str(regressions) + " regressions")
+            sys.exit(1)
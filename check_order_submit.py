@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+import sys,getopt
+import tempfile
+from synth_shopify import parse_count
+from fake_3pl_server import serve_fake_3pl
+from order_submit import OrderSubmitter, read_submissions, ACCEPTED_STATUSES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# a made up export this big is converted to verde and JD, then sent to a fake 3PL that fails a good part of the time
+CHECK_LINE_ITEMS = 300
+CHECK_FAIL_RATE = 0.2
+CHECK_LOST_RATE = 0.1
+CHECK_DROP_RATE = 0.1
+# enough that a batch failing every time is out of the question
+CHECK_RETRIES = 10
+converters = [
+        ['shopify2verde.py', '-v', os.path.join(HERE, 'verde_template.xlsx')],
+        ['shopify2jd.py', '-j', os.path.join(HERE, 'jd_template_v2.xlsx')],
+        ]
+
+def print_help():
+    help_str=' python check_order_submit.py [-n LINE_ITEMS] [--fail-rate=P] [--lost-rate=P] [--drop-rate=P] [--seed=N] [--keep] \n\
+            Checks order_submit.py end to end: converts a made up shopify export (see synth_shopify.py) with shopify2verde.py and shopify2jd.py, sends the outputs to a fake_3pl_server.py that answers 503, loses replies and hangs up half way through them, then sends them all again. Every order has to make it to the fake 3PL exactly once, the second time round every order has to come back "duplicate", and the fake 3PL may not end up with any other orders. Prints what went wrong and exits with 1 if anything did.\n\
+            -n LINE_ITEMS  how many line items in the export (default %d)\n\
+            --fail-rate=P, --lost-rate=P, --drop-rate=P  same as in fake_3pl_server.py (default %s, %s and %s)\n\
+            --seed=N  random seed for the export and the failures (default 0)\n\
+            --keep  doesn\'t delete the folder with the export and the outputs' % (CHECK_LINE_ITEMS, CHECK_FAIL_RATE, CHECK_LOST_RATE, CHECK_DROP_RATE)
+    print(help_str)
+
+def process_args(opts, args):
+    line_items = CHECK_LINE_ITEMS
+    fail_rate = CHECK_FAIL_RATE
+    lost_rate = CHECK_LOST_RATE
+    drop_rate = CHECK_DROP_RATE
+    seed = 0
+    keep = False
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt == "-n":
+            line_items = parse_count(arg)
+        elif opt == "--fail-rate":
+            fail_rate = float(arg)
+        elif opt == "--lost-rate":
+            lost_rate = float(arg)
+        elif opt == "--drop-rate":
+            drop_rate = float(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--keep":
+            keep = True
+    return (line_items, fail_rate, lost_rate, drop_rate, seed, keep)
+
+def convert_outputs(work_dir, line_items, seed):
+    # the outputs of a fresh export, in work_dir
+    shopify_fname = os.path.join(work_dir, "synth_shopify.csv")
+    subprocess.run([sys.executable, os.path.join(HERE, 'synth_shopify.py'), '-n', str(line_items), '-o', shopify_fname, '--seed', str(seed)], stdout=subprocess.DEVNULL, check=True)
+    for converter in converters:
+        subprocess.run([sys.executable, os.path.join(HERE, converter[0])] + converter[1:] + ['-s', shopify_fname, '--no-index'], cwd=work_dir, stdout=subprocess.DEVNULL, check=True)
+    return sorted(os.path.join(work_dir, fname) for fname in os.listdir(work_dir) if fname.startswith(("verde_", "jd_")))
+
+def check_submit(output_fnames, fail_rate, lost_rate, drop_rate, seed):
+    # what went wrong, [] if nothing did
+    problems = []
+    submissions = read_submissions(output_fnames, os.path.join(HERE, 'verde_template.xlsx'))
+    keys = [order['idempotency_key'] for fname, order in submissions]
+    if not submissions:
+        return ["the outputs have no orders in them"]
+    if len(set(keys)) != len(keys):
+        problems.append(str(len(keys) - len(set(keys))) + " orders have the same idempotency key as another one")
+    server = serve_fake_3pl(fail_rate=fail_rate, lost_rate=lost_rate, drop_rate=drop_rate, seed=seed)
+    submitter = OrderSubmitter("http://%s:%d/orders" % server.server_address, retries=CHECK_RETRIES)
+    try:
+        first = submitter.submit(submissions)
+        second = submitter.submit(submissions)
+    finally:
+        submitter.close()
+        server.shutdown()
+        server.server_close()
+    print(server.summary())
+
+    not_taken = [order['order'] + " (" + status + ")" for fname, order, status, attempts, error in first if status not in ACCEPTED_STATUSES]
+    if not_taken:
+        problems.append("the 3PL didn't take " + ", ".join(not_taken))
+    missing = set(keys) - set(server.orders)
+    if missing:
+        problems.append(str(len(missing)) + " orders never made it to the 3PL")
+    extra = set(server.orders) - set(keys)
+    if extra:
+        problems.append("the 3PL got " + str(len(extra)) + " orders that aren't in the outputs")
+    resent = [order['order'] + " (" + status + ")" for fname, order, status, attempts, error in second if status != "duplicate"]
+    if resent:
+        problems.append("sending the same outputs again didn't only get duplicates: " + ", ".join(resent))
+    return problems
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"hn:",["fail-rate=","lost-rate=","drop-rate=","seed=","keep"])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+    line_items, fail_rate, lost_rate, drop_rate, seed, keep = process_args(opts, args)
+
+    work_dir = tempfile.mkdtemp(prefix="check_order_submit_")
+    try:
+        output_fnames = convert_outputs(work_dir, line_items, seed)
+        print("sending " + ", ".join(os.path.basename(fname) for fname in output_fnames) + " twice")
+        problems = check_submit(output_fnames, fail_rate, lost_rate, drop_rate, seed)
+    finally:
+        if keep:
+            print("kept " + work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    for problem in problems:
+        print("FAILED: " + problem)
+    if problems:
+        sys.exit(1)
+    print("OK")
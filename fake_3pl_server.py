@@ -0,0 +1,222 @@
+import json
+import random
+import sys,getopt
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# a stand-in for a 3PL's order API, to point order_submit.py at. only ever on this machine
+FAKE_HOST = "127.0.0.1"
+FAKE_PORT = 47631
+ORDERS_PATH = "/orders"
+
+def print_help():
+    help_str=' python fake_3pl_server.py [--port=N] [--record=FNAME_RECORD] [--fail-rate=P] [--lost-rate=P] [--drop-rate=P] [--delay=SECONDS] [--seed=N] [--token=TOKEN] \n\
+            Pretends to be a 3PL\'s order API on http://%s:PORT%s, to try order_submit.py against. Orders are "created" the first time their idempotency key is seen and are a "duplicate" after that, like a real one that keeps you from shipping an order twice. Prints what it got when stopped with Ctrl-C.\n\
+            --port=N  (default %d)\n\
+            --record=FNAME_RECORD  writes every request it gets (headers, body, and what it answered) to FNAME_RECORD, one json per line\n\
+            --fail-rate=P  answers this fraction of POSTs (0 to 1) with a 503 without looking at them, to see the retries\n\
+            --lost-rate=P  takes the orders of this fraction of POSTs, then answers 500 anyway, like a reply lost on the way back. The retry should only get "duplicate"s back\n\
+            --drop-rate=P  takes the orders of this fraction of POSTs, then hangs up half way through the reply, like a connection dropped on the way back\n\
+            --delay=SECONDS  takes this long over every POST\n\
+            --seed=N  random seed for the failures (default 0)\n\
+            --token=TOKEN  only takes requests with "Authorization: Bearer TOKEN", 401 otherwise' % (FAKE_HOST, ORDERS_PATH, FAKE_PORT)
+    print(help_str)
+
+def process_args(opts, args):
+    port = FAKE_PORT
+    record_fname = None
+    fail_rate = 0.0
+    lost_rate = 0.0
+    drop_rate = 0.0
+    delay = 0.0
+    seed = 0
+    token = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--record":
+            record_fname = arg
+        elif opt == "--fail-rate":
+            fail_rate = float(arg)
+        elif opt == "--lost-rate":
+            lost_rate = float(arg)
+        elif opt == "--drop-rate":
+            drop_rate = float(arg)
+        elif opt == "--delay":
+            delay = float(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--token":
+            token = arg
+    return (port, record_fname, fail_rate, lost_rate, drop_rate, delay, seed, token)
+
+class FakeThreePL(ThreadingHTTPServer):
+    # what the fake 3PL has: the orders it took, by idempotency key, and every request it got. the handler threads
+    # share it, so everything goes through the lock.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=FAKE_PORT, record_fname=None, fail_rate=0.0, lost_rate=0.0, drop_rate=0.0, delay=0.0, seed=0, token=None):
+        super().__init__((FAKE_HOST, port), FakeOrderHandler)
+        self.fail_rate = fail_rate
+        self.lost_rate = lost_rate
+        self.drop_rate = drop_rate
+        self.delay = delay
+        self.token = token
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.requests = []
+        self.record = open(record_fname, 'a') if record_fname else None
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def take_orders(self, orders):
+        # [{'idempotency_key', 'order', 'status'}] for every order in a POST
+        results = []
+        with self.lock:
+            for order in orders:
+                key = order.get('idempotency_key')
+                if not key or not order.get('lines'):
+                    results.append({'idempotency_key': key, 'order': order.get('order'), 'status': "rejected", 'error': "no idempotency_key or no lines"})
+                elif key in self.orders:
+                    results.append({'idempotency_key': key, 'order': order.get('order'), 'status': "duplicate"})
+                else:
+                    self.orders[key] = order
+                    results.append({'idempotency_key': key, 'order': order.get('order'), 'status': "created"})
+        return results
+
+    def record_request(self, entry):
+        with self.lock:
+            self.requests.append(entry)
+            if self.record is not None:
+                self.record.write(json.dumps(entry) + "\n")
+                self.record.flush()
+
+    def summary(self):
+        statuses = {}
+        for entry in self.requests:
+            statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+        return ("got " + str(len(self.requests)) + " requests (" + ", ".join(str(count) + " x " + str(status) for status, count in sorted(statuses.items(), key=str)) + "), at most " + str(self.max_in_flight) + " at a time. has " + str(len(self.orders)) + " orders")
+
+    def server_close(self):
+        super().server_close()
+        if self.record is not None:
+            self.record.close()
+
+def parsed_body(body):
+    # for --record. as json if it is json
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode(errors='replace')
+
+class FakeOrderHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so order_submit.py's pooled connections are kept alive between POSTs
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass # the summary (and --record) say what happened, not a line per request
+
+    def reply(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        return status
+
+    def hang_up(self, body):
+        # the headers and half of the reply, then the connection is closed. recorded as "dropped"
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data[:len(data) // 2])
+        self.close_connection = True
+        return "dropped"
+
+    def do_GET(self):
+        # everything the fake 3PL has, to check what made it
+        if self.path != ORDERS_PATH:
+            return self.reply(404, {'error': "not found"})
+        with self.server.lock:
+            orders = list(self.server.orders.values())
+        self.reply(200, {'orders': orders})
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            status = self.handle_orders(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        server.record_request({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime()),
+                'path': self.path,
+                'idempotency_key': self.headers.get('Idempotency-Key'),
+                'authorization': self.headers.get('Authorization') is not None,
+                'body': parsed_body(body),
+                'status': status,
+                })
+
+    def handle_orders(self, body):
+        server = self.server
+        if self.path != ORDERS_PATH:
+            return self.reply(404, {'error': "not found"})
+        if server.token is not None and self.headers.get('Authorization') != "Bearer " + server.token:
+            return self.reply(401, {'error': "bad token"})
+        if server.roll(server.fail_rate):
+            return self.reply(503, {'error': "try again later"}, [('Retry-After', "0")])
+        try:
+            orders = json.loads(body)['orders']
+        except (ValueError, KeyError, TypeError):
+            return self.reply(400, {'error': "expected {\"orders\": [...]}"})
+        results = server.take_orders(orders)
+        if server.roll(server.lost_rate):
+            return self.reply(500, {'error': "took the orders, but pretending the reply got lost"})
+        if server.roll(server.drop_rate):
+            return self.hang_up({'results': results})
+        return self.reply(200, {'results': results})
+
+def serve_fake_3pl(port=0, **kwargs):
+    # a FakeThreePL serving in a background thread, for scripts that want one of their own. port 0 picks a free
+    # port, see server.server_address. kwargs are FakeThreePL's. stop it with server.shutdown()
+    server = FakeThreePL(port, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"h",["port=","record=","fail-rate=","lost-rate=","drop-rate=","delay=","seed=","token="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+    port, record_fname, fail_rate, lost_rate, drop_rate, delay, seed, token = process_args(opts, args)
+
+    server = FakeThreePL(port, record_fname, fail_rate, lost_rate, drop_rate, delay, seed, token)
+    print("fake 3PL taking orders on http://" + FAKE_HOST + ":" + str(server.server_address[1]) + ORDERS_PATH + ". Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(server.summary())
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+from sku_routes import ROUTED_SKU
+from shopify_loader import as_text
+
+# "po box", "p.o. box", "pobox", "post office box"... in any case, as whole words. a plain "box" isn't enough, as
+# the rule takes orders out with --quarantine and "12 Boxwood Ln" or "Mailbox Plaza" are fine. compiled once for all the rows
+PO_BOX_PATTERN = re.compile(r'\b(?:p\.?\s*o\.?|post(?:al)?\s+office)\s*box\b', re.IGNORECASE|re.MULTILINE)
+# rule -> (severity, what to tell whoever runs the conversion). "error" orders are the ones --quarantine takes out
+# of the output, "info" ones only go in the --report.
+RULES = {
+        'phone_length': ('warning', "MAKE SURE THE PHONE NUMBERS FOR THESE ORDERS ARE CORRECT"),
+        'risk_level': ('warning', "WARNING: these orders don't have a Low risk level! Please make sure they are something we want to import and not delete"),
+        'po_box': ('error', "WARNING, THESE ORDERS HAVE A PO BOX. WE CANNOT SHIP TO PO BOXES. PLEASE FIX THEM BEFORE IMPORTING THEM TO {destination}!!!"),
+        'quantity': ('info', "quantity is more than 1"),
+        }
+VERDE_CHECKS = ['risk_level', 'po_box', 'quantity']
+JD_CHECKS = ['phone_length', 'risk_level', 'po_box', 'quantity']
+REPORT_COLUMNS = ['order', 'rule', 'severity', 'detail']
+# orders listed per rule on stdout, the rest are only in the --report
+MAX_LISTED_ORDERS = 20
+
+def text_matches(col, pattern):
+    # like col.str.contains(pattern), but numbers and NaNs (e.g. an address2 that's only a unit number) never match
+    import pandas as pd
+    if pd.api.types.infer_dtype(col, skipna=True) not in ('string', 'empty', 'mixed', 'mixed-integer'):
+        return pd.Series(False, index=col.index)
+    return col.astype(object).str.contains(pattern, na=False).astype(bool)
+
+def cell_text(value):
+    # as_text() of a single value: '' for None and NaN
+    return '' if value is None or value != value else str(value)
+
+def rule_masks(rows_pd, rules, phones=None):
+    # every check as a boolean column over all the rows at once, with the value worth reporting next to it
+    import pandas as pd
+    masks = {}
+    if 'phone_length' in rules and phones is not None:
+        digits = as_text(pd.Series(phones, index=rows_pd.index)).str.len()
+        masks['phone_length'] = ((digits < 10) | (digits > 11), digits.astype(str) + " digits")
+    if 'risk_level' in rules:
+        masks['risk_level'] = (rows_pd['Risk Level'] != "Low", as_text(rows_pd['Risk Level']).replace('', 'no risk level'))
+    if 'po_box' in rules:
+        po_box = text_matches(rows_pd['Shipping Address1'], PO_BOX_PATTERN) | text_matches(rows_pd['Shipping Address2'], PO_BOX_PATTERN)
+        masks['po_box'] = (po_box, (as_text(rows_pd['Shipping Address1']) + " " + as_text(rows_pd['Shipping Address2'])).str.strip())
+    if 'quantity' in rules:
+        quantity = pd.to_numeric(rows_pd['Lineitem quantity'], errors='coerce')
+        masks['quantity'] = (quantity > 1, as_text(rows_pd['Lineitem sku']) + " x" + as_text(rows_pd['Lineitem quantity']))
+    return masks
+
+def row_rule_detail(rule, row, phone=None):
+    # rule_masks() for one row dict, for the small exports converted without pandas (see read_shopify_rows()):
+    # the detail to report if the row fails rule, otherwise None. row values are strings, None where pandas has a NaN
+    if rule == 'phone_length':
+        digits = len(phone or '')
+        return str(digits) + " digits" if digits < 10 or digits > 11 else None
+    if rule == 'risk_level':
+        return (row['Risk Level'] or 'no risk level') if row['Risk Level'] != "Low" else None
+    if rule == 'po_box':
+        address1, address2 = row['Shipping Address1'] or '', row['Shipping Address2'] or ''
+        if PO_BOX_PATTERN.search(address1) or PO_BOX_PATTERN.search(address2):
+            return (address1 + " " + address2).strip()
+        return None
+    if rule == 'quantity':
+        return (row['Lineitem sku'] or '') + " x" + row['Lineitem quantity'] if int(row['Lineitem quantity']) > 1 else None
+
+def first_detail_per_order(findings, rule):
+    # {order: detail} of every order that failed rule, with the first detail found for it, in the order they were found
+    found = {}
+    for found_rule, orders, details in findings:
+        if found_rule == rule:
+            for order, detail in zip(orders, details):
+                found.setdefault(order, detail)
+    return found
+
+class OrderChecks:
+    # the order checks of one conversion. check() is run on every batch of rows before they're converted, and
+    # finish() prints one summary line per rule and writes the --report / --quarantine files once the output is done.
+    # the converters only check the rows the order index lets through, so an order that was already sent isn't
+    # warned about or quarantined again. shopify2all.py's outputs all check their rows at the same time.
+    def __init__(self, rules, destination, report_fname=None, quarantine_fname=None):
+        self.rules = rules
+        self.destination = destination
+        self.report_fname = report_fname
+        self.quarantine_fname = quarantine_fname
+        self.findings = []
+        self.quarantined = []
+        self.lock = threading.Lock()
+
+    def check(self, rows_pd, phones=None):
+        # returns rows_pd, without the orders that failed an "error" rule if there's a quarantine file
+        kept = self.kept(rows_pd, phones)
+        return rows_pd if kept.all() else rows_pd[kept]
+
+    def kept(self, rows_pd, phones=None):
+        # check() as a boolean mask over rows_pd, False for the rows it takes out
+        import numpy as np
+        failed = np.zeros(len(rows_pd), dtype=bool)
+        for rule, (mask, detail) in rule_masks(rows_pd, self.rules, phones).items():
+            mask = mask.to_numpy()
+            if RULES[rule][0] == 'error':
+                failed |= mask
+            if mask.any():
+                # (rule, orders, details), only made into a frame if there's a --report
+                with self.lock:
+                    self.findings.append((rule, rows_pd['Name'].to_numpy()[mask], detail.to_numpy()[mask]))
+        if self.quarantine_fname is None or not failed.any():
+            return np.ones(len(rows_pd), dtype=bool)
+        # the whole order goes, not just the line item that failed
+        quarantine = rows_pd['Name'].isin(rows_pd['Name'][failed]).to_numpy()
+        # as shopify rows, so they can be fixed and converted again
+        quarantined = rows_pd[quarantine]
+        with self.lock:
+            self.quarantined.append(quarantined[~quarantined.index.duplicated()].drop(columns=[ROUTED_SKU], errors='ignore'))
+        return ~quarantine
+
+    def check_rows(self, rows, phones=None):
+        # check() for a list of row dicts, for the small exports converted without pandas. no --quarantine there
+        for rule in RULES:
+            if rule not in self.rules or (rule == 'phone_length' and phones is None):
+                continue
+            orders, details = [], []
+            for idx, row in enumerate(rows):
+                detail = row_rule_detail(rule, row, None if phones is None else phones[idx])
+                if detail is not None:
+                    orders.append(row['Name'])
+                    details.append(detail)
+            if orders:
+                self.findings.append((rule, orders, details))
+        return rows
+
+    def report(self):
+        import pandas as pd
+        if not self.findings:
+            return pd.DataFrame(columns=REPORT_COLUMNS)
+        # a line item split into several SKUs is still one finding
+        return pd.concat([pd.DataFrame({'order': orders, 'rule': rule, 'severity': RULES[rule][0], 'detail': details})
+            for rule, orders, details in self.findings], ignore_index=True).drop_duplicates()
+
+    def finish(self):
+        for rule in self.rules:
+            severity, message = RULES[rule]
+            if severity == 'info':
+                continue
+            found = first_detail_per_order(self.findings, rule)
+            if not found:
+                continue
+            listed = ", ".join(cell_text(order) + " (" + cell_text(detail) + ")" for order, detail in list(found.items())[:MAX_LISTED_ORDERS])
+            if len(found) > MAX_LISTED_ORDERS:
+                listed += ", and " + str(len(found) - MAX_LISTED_ORDERS) + " more (see --report)"
+            print(message.format(destination=self.destination) + ": " + listed)
+        if self.report_fname is not None:
+            report = self.report()
+            if os.path.splitext(self.report_fname)[1].lower() == ".json":
+                report.to_json(self.report_fname, orient='records', indent=1)
+            else:
+                report.to_csv(self.report_fname, index=False)
+            print("wrote " + str(len(report)) + " order check findings to " + self.report_fname)
+        if self.quarantine_fname is not None and self.quarantined:
+            import pandas as pd
+            # the same shopify row is in here once for every output of shopify2all.py that had it
+            quarantined = pd.concat(self.quarantined)
+            quarantined = quarantined[~quarantined.reset_index().duplicated().to_numpy()]
+            quarantined.to_csv(self.quarantine_fname, index=False)
+            print("QUARANTINED " + str(quarantined['Name'].nunique()) + " orders that failed a check, they are NOT in the output. Fix them in " + self.quarantine_fname + " and convert that file again")
@@ -0,0 +1,142 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from sku_routes import ROUTED_SKU
+from shopify_loader import as_text
+
+# every line item we've already sent to a 3PL, so re-running on a cumulative shopify export only sends the new ones
+ORDER_INDEX_FNAME = "processed_orders.sqlite"
+# a line item whose shipping details or quantity change in a later export is sent again
+DIGEST_COLUMNS = ['Shipping Name', 'Shipping Address1', 'Shipping Address2', 'Shipping City', 'Shipping Province',
+        'Shipping Zip', 'Shipping Country', 'Shipping Phone', 'Lineitem quantity']
+KEY_SEP = '\x1f'
+# line items looked up per query, well under sqlite's limit on ? parameters
+LOOKUP_BATCH = 500
+
+def line_item_keys(rows_pd, sku_col=ROUTED_SKU):
+    # order Name + the SKU that went to the 3PL + which line of that order with that SKU it is, for the
+    # orders that have the same SKU on more than one line
+    keys = as_text(rows_pd['Name']) + KEY_SEP + as_text(rows_pd[sku_col])
+    return keys + KEY_SEP + keys.groupby(keys.to_numpy(), sort=False).cumcount().astype(str)
+
+def digest_text(text):
+    # text is the DIGEST_COLUMNS of a line item joined with KEY_SEP, '' for the missing ones. plain python, so the
+    # converters' pandas and no-pandas paths (see select_new_rows()) record the same digest for the same line item
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+def line_item_digests(rows_pd):
+    import pandas as pd
+    columns = [col for col in DIGEST_COLUMNS if col in rows_pd.columns]
+    texts = [as_text(rows_pd[col]) for col in columns]
+    joined = texts[0].str.cat(texts[1:], sep=KEY_SEP) if texts else pd.Series('', index=rows_pd.index)
+    return pd.Series([digest_text(text) for text in joined.tolist()], index=rows_pd.index, dtype=object)
+
+def row_digest(row):
+    # line_item_digests() of one row dict, whose values are strings or None
+    return digest_text(KEY_SEP.join(row[col] or '' for col in DIGEST_COLUMNS if col in row))
+
+class OrderIndex:
+    # sqlite table of (destination, order name, 3PL SKU) -> digest of what was sent. only the line items of the
+    # export (or --stream chunk) being converted are looked up, in batches on the primary key, then every row is
+    # checked against them with a single vectorized map. nothing of the index's history is kept in memory, so
+    # --stream stays bounded by the chunk size however big the index gets, and every lookup sees what other
+    # converters added since. the rows select_new() lets through are checked and quarantined by the converters,
+    # and what's left is passed to add_pending(). they're only written to the index by commit(), once the output
+    # that has them is safely on disk. until then they wait in a temp table, which sqlite keeps in a temp file that
+    # doesn't lock the index for anyone else.
+    def __init__(self, fname=ORDER_INDEX_FNAME):
+        self.fname = fname
+        self.pending_db = None
+        self.lock = threading.Lock()
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS processed (destination TEXT NOT NULL, line_item TEXT NOT NULL, digest TEXT NOT NULL, outfile TEXT, processed_at TEXT, PRIMARY KEY (destination, line_item))")
+
+    def connect(self):
+        # a connection per use, so the converters' worker threads can share one OrderIndex
+        return sqlite3.connect(self.fname)
+
+    def add_pending(self, destination, line_items):
+        # (line item, digest) of the rows select_new() let through that made it into the output, for commit(). the
+        # one connection that has the temp table is shared by every thread, under the lock
+        with self.lock:
+            if self.pending_db is None:
+                self.pending_db = sqlite3.connect(self.fname, check_same_thread=False)
+                self.pending_db.execute("PRAGMA temp_store = FILE")
+                self.pending_db.execute("CREATE TEMP TABLE pending (destination TEXT NOT NULL, line_item TEXT NOT NULL, digest TEXT NOT NULL)")
+            with self.pending_db as db:
+                db.executemany("INSERT INTO pending VALUES (?, ?, ?)", [(destination, key, digest) for key, digest in line_items])
+
+    def stored_digests(self, destination, keys):
+        # {line item: digest} of the keys that are in the index
+        keys = list(set(keys))
+        stored = {}
+        with self.connect() as db:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start+LOOKUP_BATCH]
+                stored.update(db.execute("SELECT line_item, digest FROM processed WHERE destination = ? AND line_item IN (" + ",".join("?" * len(batch)) + ")", [destination] + batch))
+        return stored
+
+    def select_new(self, rows_pd, destination, sku_col=ROUTED_SKU):
+        # only the rows that aren't in the index yet, or that changed since they were sent, and a (line item, digest)
+        # for each of them to add_pending() the ones that are kept
+        keys = line_item_keys(rows_pd, sku_col)
+        digests = line_item_digests(rows_pd)
+        stored = keys.map(self.stored_digests(destination, keys.tolist())).astype(object)
+        new = (stored != digests).to_numpy()
+        self.skipped(int((~new).sum()), destination)
+        return rows_pd[new], list(zip(keys[new].tolist(), digests[new].tolist()))
+
+    def select_new_rows(self, rows, destination, sku_col=ROUTED_SKU):
+        # select_new() for a list of row dicts (see read_shopify_rows()), with the same keys and digests
+        lines = {}
+        keys = []
+        for row in rows:
+            key = (row['Name'] or '') + KEY_SEP + (row[sku_col] or '')
+            lines[key] = lines.get(key, -1) + 1
+            keys.append(key + KEY_SEP + str(lines[key]))
+        stored = self.stored_digests(destination, keys)
+        new_rows, line_items = [], []
+        for row, key in zip(rows, keys):
+            digest = row_digest(row)
+            if stored.get(key) != digest:
+                new_rows.append(row)
+                line_items.append((key, digest))
+        self.skipped(len(rows) - len(new_rows), destination)
+        return new_rows, line_items
+
+    def skipped(self, count, destination):
+        if count:
+            print("Skipping " + str(count) + " line items that were already sent to " + destination + " (see --no-index / --rebuild-index)")
+
+    def commit(self, outfile=None):
+        # record everything select_new() let through since the last commit, in one transaction
+        with self.lock:
+            if self.pending_db is None:
+                return
+            processed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+            with self.pending_db as db:
+                db.execute("INSERT OR REPLACE INTO processed SELECT destination, line_item, digest, ?, ? FROM pending ORDER BY rowid", (outfile, processed_at))
+                db.execute("DELETE FROM pending")
+
+    def discard(self):
+        # forget what select_new() let through since the last commit, when the output it was for never got written
+        with self.lock:
+            if self.pending_db is not None:
+                with self.pending_db as db:
+                    db.execute("DELETE FROM pending")
+
+    def clear(self, destination):
+        # forget everything sent to destination, so the next run converts every line item again
+        with self.lock:
+            with self.connect() as db:
+                db.execute("DELETE FROM processed WHERE destination = ?", (destination,))
+
+def open_order_index(index_fname, use_index=True, rebuild_destinations=()):
+    # what the converters' --index / --no-index / --rebuild-index options turn into
+    if not use_index:
+        return None
+    order_index = OrderIndex(index_fname)
+    for destination in rebuild_destinations:
+        order_index.clear(destination)
+    return order_index
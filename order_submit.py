@@ -0,0 +1,295 @@
+import csv
+import hashlib
+import json
+import os
+import random
+import sys,getopt
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from shopify_loader import expand_shopify_fnames
+
+# orders per POST, and how many POSTs are in flight at once (also the size of the connection pool)
+SUBMIT_BATCH_SIZE = 50
+SUBMIT_WORKERS = 4
+# a batch that gets a connection error, a timeout, a reply cut off half way or one of these statuses is sent again, up
+# to SUBMIT_RETRIES more times, waiting SUBMIT_BACKOFF seconds, then twice that and so on (never more than
+# SUBMIT_BACKOFF_MAX, or whatever the 3PL's Retry-After says). any other status is the 3PL saying no, so there's no
+# point sending it again
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+SUBMIT_RETRIES = 5
+SUBMIT_BACKOFF = 0.5
+SUBMIT_BACKOFF_MAX = 30.0
+# what the 3PL can say it did with an order it now has. an order it said nothing about is "accepted"
+ACCEPTED_STATUSES = {"accepted", "created", "duplicate"}
+# (connect, read) seconds
+SUBMIT_TIMEOUT = (5, 60)
+# the bearer token for the 3PL's API, so it doesn't have to be on the command line
+SUBMIT_TOKEN_ENV = "THREEPL_API_TOKEN"
+# which column of each converter's output has what
+OUTPUT_FORMATS = {
+        'verde': {'order': 'ReferenceNumber', 'sku': 'SKU', 'quantity': 'Quantity'},
+        'jd': {'order': '*Customer Order No.', 'sku': '*Customer SKU ID', 'quantity': '*Quantity'},
+        }
+# the JD sheets, the first one has the line items
+JD_SHEETS = ['Outbound Order Info', 'Service Product Info']
+
+def print_help():
+    help_str=' python order_submit.py --endpoint=URL -f FNAME_OUTPUT [-f FNAME_OUTPUT ...] [-v FNAME_VERDE] [--batch-size=N] [--workers=N] [--retries=N] [--token=TOKEN] [--log=FNAME_LOG] \n\
+            Sends the orders in converted outputs (verde_*.txt from shopify2verde.py, jd_*.xlsx from shopify2jd.py) to the 3PL\'s order API instead of uploading the files by hand. Every order goes out as json with all its rows, batched into POSTs to URL. Try it against python fake_3pl_server.py first, python check_order_submit.py does that end to end.\n\
+            --endpoint=URL  where the 3PL takes orders, e.g. http://127.0.0.1:47631/orders\n\
+            -f FNAME_OUTPUT  (--file=FNAME_OUTPUT) the outputs to send. Can be given more than once, as a comma separated list or a glob like "verde_*_10-18_*.txt"\n\
+            -v FNAME_VERDE  (--verde=FNAME_VERDE) the verde template the .txt outputs were made with, for their column names (default verde_template.xlsx)\n\
+            --batch-size=N  orders per POST (default %d)\n\
+            --workers=N  POSTs in flight at the same time, over one pool of kept-alive connections (default %d)\n\
+            --retries=N  how many more times a batch is sent after a connection error, a timeout, a reply that got cut off or a 408/425/429/5xx, waiting longer each time (default %d)\n\
+            --token=TOKEN  sent as "Authorization: Bearer TOKEN" (default: the %s environment variable, if it is set)\n\
+            --log=FNAME_LOG  where to write what happened to every order (default submitted_TIMESTAMP.csv)\n\n\
+            Every order carries an idempotency key made from the 3PL, its Name and its SKUs and quantities, and every POST an Idempotency-Key made from the keys of its orders. A retried batch, or the same output sent again, gets the same keys, so the 3PL ships it once. The keys are in the log next to each order.\n\
+            Exit code 1 if any order didn\'t make it.' % (SUBMIT_BATCH_SIZE, SUBMIT_WORKERS, SUBMIT_RETRIES, SUBMIT_TOKEN_ENV)
+    print(help_str)
+
+def process_args(opts, args):
+    endpoint = None
+    output_fnames = []
+    verde_fname = None
+    batch_size = SUBMIT_BATCH_SIZE
+    workers = SUBMIT_WORKERS
+    retries = SUBMIT_RETRIES
+    token = os.environ.get(SUBMIT_TOKEN_ENV)
+    log_fname = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt == "--endpoint":
+            endpoint = arg
+        elif opt in ("-f", "--file"):
+            output_fnames.append(arg)
+        elif opt in ("-v", "--verde"):
+            verde_fname = arg
+        elif opt == "--batch-size":
+            batch_size = int(arg)
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--retries":
+            retries = int(arg)
+        elif opt == "--token":
+            token = arg
+        elif opt == "--log":
+            log_fname = arg
+    return (endpoint, expand_shopify_fnames(output_fnames, "outputs"), verde_fname, batch_size, workers, retries, token, log_fname)
+
+def output_destination(fname):
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == ".txt":
+        return "verde"
+    if ext == ".xlsx":
+        return "jd"
+    raise ValueError("don't know which 3PL " + fname + " is for, only verde .txt and JD .xlsx outputs can be sent")
+
+def row_dict(columns, values):
+    # the empty cells are left out
+    return {col: value for col, value in zip(columns, values) if value is not None and value != ''}
+
+def read_verde_orders(fname, columns):
+    # {order Name: {'lines': [row dicts]}} of a shopify2verde.py output, in file order. the .txt has no header row,
+    # its columns are the template's
+    orders = {}
+    with open(fname, newline='') as f:
+        for values in csv.reader(f, delimiter='\t'):
+            if values:
+                row = row_dict(columns, values)
+                orders.setdefault(row.get(OUTPUT_FORMATS['verde']['order'], ''), {'lines': []})['lines'].append(row)
+    return orders
+
+def read_jd_orders(fname):
+    # {order Name: {'lines': [Outbound Order Info rows], 'services': [Service Product Info rows]}} of a shopify2jd.py
+    # output, in file order. the column headers are on the second row, under JD's merged headers
+    from openpyxl import load_workbook
+    from template_cache import header_names
+    workbook = load_workbook(fname, read_only=True)
+    orders = {}
+    for sheet_name, key in zip(JD_SHEETS, ['lines', 'services']):
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        next(rows, None)
+        columns = header_names(next(rows, ()))
+        for values in rows:
+            if any(value is not None for value in values):
+                row = row_dict(columns, values)
+                order = orders.setdefault(str(row.get(OUTPUT_FORMATS['jd']['order'], '')), {'lines': [], 'services': []})
+                order[key].append(row)
+    workbook.close()
+    return orders
+
+def idempotency_key(destination, name, lines):
+    # the same order Name can go out more than once: in the mats output and the balls output, or when new line items
+    # of it come in later. what's in it is part of the key, so those are different orders to the 3PL, while sending the
+    # same order again never is
+    fmt = OUTPUT_FORMATS[destination]
+    items = sorted("%s x%s" % (line.get(fmt['sku'], ''), line.get(fmt['quantity'], '')) for line in lines)
+    text = "\x1f".join([destination, name] + items)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def read_submissions(output_fnames, verde_fname=None):
+    # every order in the outputs as (outfile, the json that's sent for it), in file order
+    columns = None
+    submissions = []
+    for fname in output_fnames:
+        destination = output_destination(fname)
+        if destination == "verde":
+            if columns is None:
+                import shopify2verde
+                columns = shopify2verde.verde_template_columns(verde_fname) or list(shopify2verde.load_verde_template(verde_fname).columns)
+            orders = read_verde_orders(fname, columns)
+        else:
+            orders = read_jd_orders(fname)
+        for name, order in orders.items():
+            submissions.append((fname, dict({'idempotency_key': idempotency_key(destination, name, order['lines']), 'destination': destination, 'order': name}, **order)))
+    return submissions
+
+def batches(submissions, batch_size):
+    # orders for different 3PLs never share a POST
+    batch = []
+    for submission in submissions:
+        if batch and (len(batch) == batch_size or batch[-1][1]['destination'] != submission[1]['destination']):
+            yield batch
+            batch = []
+        batch.append(submission)
+    if batch:
+        yield batch
+
+def backoff_seconds(attempt, retry_after=None):
+    # exponential with jitter, so the workers that all got a 503 at once don't all come back at once
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), SUBMIT_BACKOFF_MAX)
+        except ValueError: # an HTTP date, not worth parsing
+            pass
+    return min(SUBMIT_BACKOFF * 2**attempt, SUBMIT_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+class OrderSubmitter:
+    # POSTs batches of orders to the 3PL. one requests session is shared by all the workers, so connections are
+    # kept alive and reused instead of a new TCP (and TLS) handshake per batch.
+    def __init__(self, endpoint, workers=SUBMIT_WORKERS, retries=SUBMIT_RETRIES, token=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.endpoint = endpoint
+        self.workers = workers
+        self.retries = retries
+        self.session = requests.Session()
+        # as many pooled connections as there are workers, so none of them waits on another's connection
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers['Content-Type'] = "application/json"
+        if token:
+            self.session.headers['Authorization'] = "Bearer " + token
+        self.lock = threading.Lock()
+
+    def post(self, orders):
+        # one batch, retried until it gets an answer that isn't worth retrying. returns (status, json reply or
+        # None, attempts, error)
+        import requests
+        body = json.dumps({'orders': orders}, default=str)
+        # the same orders always get the same key, so a batch whose reply got lost is recognised when it's sent again
+        batch_key = hashlib.blake2b("\x1f".join(order['idempotency_key'] for order in orders).encode(), digest_size=16).hexdigest()
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(self.endpoint, data=body, headers={'Idempotency-Key': batch_key}, timeout=SUBMIT_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError) as e:
+                status, error = None, type(e).__name__ + ": " + str(e)
+            except requests.RequestException as e:
+                # a bad URL and the like, the same again won't go any better
+                return None, None, attempt + 1, type(e).__name__ + ": " + str(e)
+            else:
+                status, error = response.status_code, response.text[:500]
+                if status not in RETRY_STATUSES:
+                    try:
+                        reply = response.json()
+                    except ValueError:
+                        reply = None
+                    return status, reply, attempt + 1, None if 200 <= status < 300 else error
+                retry_after = response.headers.get('Retry-After')
+            if attempt < self.retries:
+                wait = backoff_seconds(attempt, retry_after)
+                with self.lock:
+                    print("batch of " + str(len(orders)) + " orders failed (" + (str(status) if status else error.split(":")[0]) + "), trying again in %.1fs" % wait)
+                time.sleep(wait)
+        return status, None, self.retries + 1, error
+
+    def submit_batch(self, batch):
+        # [(outfile, order, status, attempts, error)] of one batch
+        orders = [order for fname, order in batch]
+        status, reply, attempts, error = self.post(orders)
+        if error is not None:
+            return [(fname, order, "failed", attempts, error) for fname, order in batch]
+        # the 3PL says what it did with each order, by key. an order it doesn't mention is taken as accepted
+        results = {result.get('idempotency_key'): result for result in (reply or {}).get('results', [])}
+        submitted = []
+        for fname, order in batch:
+            result = results.get(order['idempotency_key'], {})
+            submitted.append((fname, order, result.get('status', "accepted"), attempts, result.get('error')))
+        return submitted
+
+    def submit(self, submissions, batch_size=SUBMIT_BATCH_SIZE):
+        # every batch, at most self.workers at a time. returns the submit_batch() results in the orders' order. a
+        # batch that blew up is "failed" with what it raised, as the batches before it are already at the 3PL and
+        # have to make it into the log
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [(batch, pool.submit(self.submit_batch, batch)) for batch in batches(submissions, batch_size)]
+            submitted = []
+            for batch, future in futures:
+                try:
+                    submitted.extend(future.result())
+                except Exception as e:
+                    submitted.extend((fname, order, "failed", None, type(e).__name__ + ": " + str(e)) for fname, order in batch)
+            return submitted
+
+    def close(self):
+        self.session.close()
+
+def write_submission_log(log_fname, submitted):
+    with open(log_fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['outfile', 'destination', 'order', 'idempotency_key', 'status', 'attempts', 'error'])
+        for fname, order, status, attempts, error in submitted:
+            writer.writerow([fname, order['destination'], order['order'], order['idempotency_key'], status, attempts, error or ''])
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"hf:v:",["endpoint=","file=","verde=","batch-size=","workers=","retries=","token=","log="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+    endpoint, output_fnames, verde_fname, batch_size, workers, retries, token, log_fname = process_args(opts, args)
+
+    if endpoint is None:
+        print_help()
+        print("--endpoint= option is missing")
+        sys.exit(2)
+    if not output_fnames:
+        print_help()
+        print("-f option is missing, nothing to send")
+        sys.exit(2)
+
+    submissions = read_submissions(output_fnames, verde_fname)
+    print("sending " + str(len(submissions)) + " orders from " + ", ".join(output_fnames) + " to " + endpoint)
+    submitter = OrderSubmitter(endpoint, workers, retries, token)
+    try:
+        submitted = submitter.submit(submissions, batch_size)
+    finally:
+        submitter.close()
+    if log_fname is None:
+        log_fname = "submitted_" + time.strftime('%m-%d_%H%M%S', time.localtime()) + ".csv"
+    write_submission_log(log_fname, submitted)
+
+    counts = {}
+    for fname, order, status, attempts, error in submitted:
+        counts[status] = counts.get(status, 0) + 1
+    print(", ".join(str(count) + " " + status for status, count in counts.items()) + ". wrote " + log_fname)
+    failed = [order['order'] for fname, order, status, attempts, error in submitted if status not in ACCEPTED_STATUSES]
+    if failed:
+        print("WARNING: THESE ORDERS WERE NOT TAKEN BY THE 3PL, SEE " + log_fname + ": " + ", ".join(failed))
+        sys.exit(1)
@@ -0,0 +1,25 @@
+# cleaning up the shipping fields of a shopify export the same way for every 3PL. the frame versions take a column
+# of the export, the _text ones one value of a read_shopify_rows() row, for the converters' no-pandas path.
+import re
+
+PHONE_FORMATTING = r'[() -]'
+
+def clean_phone(phones):
+    # strip the formatting shopify leaves in phone numbers, and drop the leading country code from 11 digit numbers
+    phones = phones.fillna('').astype(str).str.replace(PHONE_FORMATTING, '', regex=True)
+    return phones.where(phones.str.len() != 11, phones.str[1:])
+
+def clean_phone_text(phone):
+    # clean_phone() of one phone number, None if there's none
+    phone = re.sub(PHONE_FORMATTING, '', phone or '')
+    return phone[1:] if len(phone) == 11 else phone
+
+def clean_zip(zips):
+    # zips that lost their leading zeros somewhere along the way (07731 saved as 7731 by a spreadsheet) get them
+    # back. no zip stays empty
+    zips = zips.fillna('').astype(str)
+    return zips.str.zfill(5).where(zips != '', '')
+
+def clean_zip_text(zip_code):
+    # clean_zip() of one zip, '' if there's none
+    return zip_code.zfill(5) if zip_code else ''
@@ -0,0 +1,180 @@
+import os
+import sys,getopt
+import time
+from concurrent.futures import ThreadPoolExecutor
+import shopify2verde
+import shopify2jd
+from shopify_loader import read_shopify_files, expand_shopify_fnames, paid_line_items
+from sku_routes import load_sku_routes
+from order_checks import OrderChecks, VERDE_CHECKS, JD_CHECKS
+from order_index import open_order_index, ORDER_INDEX_FNAME
+from stage_profile import StageProfiler, NULL_PROFILER
+
+# "all" is the same as not passing -o to shopify2verde.py / shopify2jd.py, the rest come from sku_routes.csv
+sku_modes = ["all"] + load_sku_routes().modes()
+
+def print_help():
+    help_str=' python shopify2all.py -s FNAME_SHOPIFY [-s FNAME_SHOPIFY ...] [-v FNAME_VERDE] [-j FNAME_JD] [--verde-only=MODES] [--jd-only=MODES] [--workers=N] [--no-cache] [--index=FNAME_INDEX | --no-index | --rebuild-index] [--report=FNAME_REPORT] [--quarantine=FNAME_QUARANTINE] [--profile [--profile-dump=FNAME_PROF]] \n\
+            Reads the shopify export once and writes every requested verde and JD output from it in one go, instead of running shopify2verde.py and shopify2jd.py once per -o option.\n\
+            -s FNAME_SHOPIFY (--shopify=FNAME_SHOPIFY) where FNAME_SHOPIFY is the path to the SHOPIFY template .csv file. Can be given more than once, as a comma separated list or a glob, same as in shopify2verde.py and shopify2jd.py\n\
+            -v FNAME_VERDE  (--verde=FNAME_VERDE) the VERDE template, same as in shopify2verde.py. Downloaded if missing.\n\
+            -j FNAME_JD  (--jd=FNAME_JD) the JD template, same as in shopify2jd.py. Required if --jd-only is used.\n\
+            --verde-only=MODES  comma separated list of "all" or any mode in sku_routes.csv ("mats" "playpens" "balls" "accessories"), one verde .txt is written per mode\n\
+            --jd-only=MODES  comma separated list of the same modes, one JD .xlsx is written per mode\n\
+            --workers=N  how many outputs to write, and how many shopify exports to parse, at the same time (default: one per output / one per core)\n\
+            --no-cache  always parse the shopify exports instead of loading them from .3pl_cache/shopify/, same as in shopify2verde.py and shopify2jd.py\n\
+            --index=FNAME_INDEX  the same index of already sent line items as shopify2verde.py and shopify2jd.py use (default %s), only updated once every output is written\n\
+            --no-index ignores the index, --rebuild-index forgets everything already sent to the requested 3PLs before converting\n\
+            --report=FNAME_REPORT and --quarantine=FNAME_QUARANTINE  same as in shopify2verde.py and shopify2jd.py. only the line items the index lets through are checked, each order is reported once, and a quarantined order is left out of every output\n\
+            --profile and --profile-dump=FNAME_PROF  same as in shopify2verde.py and shopify2jd.py, with every output\'s steps timed on their own (e.g. "build jd[mats]"). The json trace is shopify2all_TIMESTAMP.profile.json. As the outputs are built at the same time, only one of them at a time makes it into the cProfile dump\n\n\
+            For example, --verde-only=mats,balls --jd-only=playpens writes verde_mats_TIMESTAMP.txt, verde_balls_TIMESTAMP.txt and jd_playpens_TIMESTAMP.xlsx' % ORDER_INDEX_FNAME
+    print(help_str)
+
+def parse_modes(arg):
+    modes = [mode.strip() for mode in arg.split(",") if mode.strip()]
+    for mode in modes:
+        if mode not in sku_modes:
+            print("Unknown SKU mode \"" + mode + "\". Has to be one of: " + ", ".join(sku_modes))
+            sys.exit(2)
+    return modes
+
+def process_args(opts, args):
+    verde_fname = None
+    jd_fname = None
+    shopify_fnames = []
+    verde_modes = []
+    jd_modes = []
+    workers = None
+    index_fname = ORDER_INDEX_FNAME
+    use_index = True
+    rebuild_index = False
+    report_fname = None
+    quarantine_fname = None
+    profile = False
+    profile_dump_fname = None
+    use_cache = True
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt in ("-v", "--verde"):
+            verde_fname = arg
+        elif opt in ("-j", "--jd"):
+            jd_fname = arg
+        elif opt in ("-s", "--shopify"):
+            shopify_fnames.append(arg)
+        elif opt == "--verde-only":
+            verde_modes = parse_modes(arg)
+        elif opt == "--jd-only":
+            jd_modes = parse_modes(arg)
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--index":
+            index_fname = arg
+        elif opt == "--no-index":
+            use_index = False
+        elif opt == "--rebuild-index":
+            rebuild_index = True
+        elif opt == "--report":
+            report_fname = arg
+        elif opt == "--quarantine":
+            quarantine_fname = arg
+        elif opt == "--no-cache":
+            use_cache = False
+        elif opt == "--profile":
+            profile = True
+        elif opt == "--profile-dump":
+            profile = True
+            profile_dump_fname = arg
+    return (verde_fname, jd_fname, expand_shopify_fnames(shopify_fnames), verde_modes, jd_modes, workers, index_fname, use_index, rebuild_index, report_fname, quarantine_fname, profile, profile_dump_fname, use_cache)
+
+def only_sku_of(mode):
+    return None if mode == "all" else mode
+
+def verde_output(paid_pd, verde_pd, mode, outfile, checks, order_index=None, profiler=NULL_PROFILER):
+    with profiler.cprofile():
+        verde_pd = shopify2verde.build_verde(paid_pd, verde_pd, only_sku_of(mode), checks, order_index, profiler)
+    with profiler.stage("write verde[" + mode + "]", len(verde_pd)):
+        verde_pd.to_csv(outfile,index=False,header=None,sep='\t')
+    return outfile
+
+def jd_output(paid_pd, jd_pd, merged_headers, mode, outfile, sku_weights, checks, order_index=None, profiler=NULL_PROFILER):
+    with profiler.cprofile():
+        jd_pd = shopify2jd.build_jd(paid_pd, jd_pd, only_sku_of(mode), sku_weights, checks, order_index, profiler)
+    with profiler.stage("write jd[" + mode + "]", len(jd_pd['Outbound Order Info'])):
+        shopify2jd.write_jd(jd_pd, outfile, merged_headers)
+    return outfile
+
+def all_checks(verde_modes, jd_modes, report_fname=None, quarantine_fname=None):
+    destinations = [destination for destination, modes in (("VERDE", verde_modes), ("JD", jd_modes)) if modes]
+    return OrderChecks(JD_CHECKS if jd_modes else VERDE_CHECKS, " AND ".join(destinations), report_fname, quarantine_fname)
+
+def shop2all(shop_pd, verde_pd, jd_pd, jd_merged_headers, verde_modes, jd_modes, timestamp, workers=None, order_index=None, checks=None, profiler=NULL_PROFILER, sku_weights=None, out_dir=""):
+    # the paid filter is done once for every output. the builders never modify paid_pd or the templates, so all the
+    # outputs can be built and written at the same time from the same frames. each output checks the rows the order
+    # index lets through for it, with the one set of checks (JD's are a superset of verde's, they add the phone
+    # number length check), which reports an order once however many outputs it's in.
+    with profiler.stage("paid filter", len(shop_pd)) as stage:
+        paid_pd = paid_line_items(shop_pd)
+        stage.rows_out = len(paid_pd)
+    if checks is None:
+        checks = all_checks(verde_modes, jd_modes)
+    if sku_weights is None and jd_modes:
+        sku_weights = shopify2jd.load_sku_weights()
+
+    with ThreadPoolExecutor(max_workers=workers or max(len(verde_modes) + len(jd_modes), 1)) as pool:
+        futures = []
+        for mode in verde_modes:
+            futures.append(pool.submit(verde_output, paid_pd, verde_pd, mode, os.path.join(out_dir, "verde_"+mode+"_"+timestamp+".txt"), checks, order_index, profiler))
+        for mode in jd_modes:
+            futures.append(pool.submit(jd_output, paid_pd, jd_pd, jd_merged_headers, mode, os.path.join(out_dir, "jd_"+mode+"_"+timestamp+".xlsx"), sku_weights, checks, order_index, profiler))
+        # .result() re-raises anything that went wrong in a worker
+        outfiles = [future.result() for future in futures]
+    if order_index is not None:
+        # every output made it to disk, so none of their line items get sent again
+        with profiler.stage("order index commit"):
+            order_index.commit(",".join(outfiles))
+    with profiler.stage("checks report"):
+        checks.finish()
+    return outfiles
+
+if __name__ == "__main__":
+    # take in commandline arguments
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"hv:j:s:",["verde=","jd=","shopify=","verde-only=","jd-only=","workers=","no-cache","index=","no-index","rebuild-index","report=","quarantine=","profile","profile-dump="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    #run through each arg from commandline
+    verde_fname, jd_fname, shopify_fnames, verde_modes, jd_modes, workers, index_fname, use_index, rebuild_index, report_fname, quarantine_fname, profile, profile_dump_fname, use_cache = process_args(opts, args)
+
+    if not shopify_fnames:
+        print_help()
+        print("--shopify= option is missing")
+        sys.exit(2)
+    if not verde_modes and not jd_modes:
+        print_help()
+        print("nothing to do, please pass --verde-only= and/or --jd-only=")
+        sys.exit(2)
+    if jd_modes and jd_fname is None:
+        print ("-j argument (--jd=) argument is missing. Please use -j to specify which .xlsx is the JD template file")
+        sys.exit(2)
+
+    profiler = StageProfiler(profile, profile_dump_fname) if profile else NULL_PROFILER
+    # every template and shopify export is only read once, no matter how many outputs there are
+    with profiler.stage("template"):
+        verde_pd = shopify2verde.load_verde_template(verde_fname) if verde_modes else None
+        jd_pd = shopify2jd.load_jd_template(jd_fname) if jd_modes else None
+        jd_merged_headers = shopify2jd.load_jd_merged_headers(jd_fname) if jd_modes else None
+    with profiler.stage("read shopify") as stage:
+        shop_pd = read_shopify_files(shopify_fnames, workers, use_cache)
+        stage.rows_out = len(shop_pd)
+    rebuild_destinations = [destination for destination, modes in (("verde", verde_modes), ("jd", jd_modes)) if modes and rebuild_index]
+    order_index = open_order_index(index_fname, use_index, rebuild_destinations)
+    checks = all_checks(verde_modes, jd_modes, report_fname, quarantine_fname)
+
+    timestamp = time.strftime('%m-%d_%H%M%S', time.localtime())
+    for outfile in shop2all(shop_pd, verde_pd, jd_pd, jd_merged_headers, verde_modes, jd_modes, timestamp, workers, order_index, checks, profiler):
+        print("wrote " + outfile)
+    profiler.finish("shopify2all_" + timestamp + ".profile.json")
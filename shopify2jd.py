@@ -1,301 +1,328 @@
-import pandas as pd
-import requests
-import csv
 import os
 import sys,getopt
 import time
-import numpy as np
-import re
-import xlsxwriter
-from openpyxl import load_workbook
+from itertools import compress
+from shopify_loader import read_shopify_files, read_shopify_files_chunks, expand_shopify_fnames, paid_line_items, STREAM_CHUNKSIZE
+from shopify_cache import SHOPIFY_CACHE_MAX_BYTES
+from sku_routes import load_sku_routes, ROUTED_SKU, SKU_ROUTES_FNAME
+from order_checks import OrderChecks, JD_CHECKS
+from order_index import open_order_index, ORDER_INDEX_FNAME
+from stage_profile import StageProfiler, NULL_PROFILER, profile_trace_fname
+from template_cache import load_template_schema, template_frames
+from shipping_fields import clean_phone, clean_zip
+
+SKU_WEIGHTS_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sku_weights.csv")
+
+service_map = {
+        "Surepost_under1lb" : "SPB9900hf",
+        "Surepost_over1lb" : "SPB9900he",
+        "UPS_ground" : "SPB99008u",
+        }
+# weight brackets (lbs) for each shipping service, lower bound inclusive
+service_weight_bins = [0, 1, 10, float('inf')]
+service_weight_labels = ["Surepost_under1lb", "UPS_ground", "Surepost_over1lb"]
 
 def print_help():
-    help_str=' python shopify2jd.py -v FNAME_JD -s FNAME_SHOPIFY [-o SKUOPTION] \n\
-            -j FNAME_JD  (--JD=FNAME_JD) where FNAME_JD is the path to the JD template .csv file. Should just be this file: https://secure-wms.com/ViaSub.WMS/ImportFiles/Order%20Import%20Template.xlsx. The script will *TRY* to download this file but if the URL has changed, you will need to have a copy of it in your local area.\n\
-            -s FNAME_SHOPIFY (--shopify==FNAME_SHOPIFY) where FNAME_SHOPIFY is the path to the SHOPIFY template .csv file\n\
-            -o SKUOPTION (--only=SKUOPTION) can be "mats" "playpens" "balls" "accessories", filters out sku list from shopify and transforms them into a singular SKU.\n\n\
+    help_str=' python shopify2jd.py -v FNAME_JD -s FNAME_SHOPIFY [-s FNAME_SHOPIFY ...] [-o SKUOPTION] [--workers=N] [--no-cache] [--stream [--chunksize=N]] [--index=FNAME_INDEX | --no-index | --rebuild-index] [--report=FNAME_REPORT] [--quarantine=FNAME_QUARANTINE] [--profile [--profile-dump=FNAME_PROF]] \n\
+            -j FNAME_JD  (--JD=FNAME_JD) where FNAME_JD is the path to the JD template .csv file. Should just be this file: https://secure-wms.com/ViaSub.WMS/ImportFiles/Order%%20Import%%20Template.xlsx. The script will *TRY* to download this file but if the URL has changed, you will need to have a copy of it in your local area.\n\
+            -s FNAME_SHOPIFY (--shopify==FNAME_SHOPIFY) where FNAME_SHOPIFY is the path to the SHOPIFY template .csv file. Can be given more than once, as a comma separated list or as a glob like "orders_*.csv" to convert several (overlapping) exports into one output. Line items that are in more than one of them (same Name and Lineitem sku) are only converted once.\n\
+            --workers=N  how many exports to parse at the same time when there is more than one (default: one per core)\n\
+            --no-cache  always parse the shopify exports. Normally a parsed export is kept in .3pl_cache/shopify/ (needs pyarrow), keyed by what is in the file, and converting the same file again (in any mode, to any 3PL) loads it from there instead. The least recently used ones are deleted past %d GB.\n\
+            -o SKUOPTION (--only=SKUOPTION) can be "mats" "playpens" "balls" "accessories" (or any other mode in sku_routes.csv), filters out sku list from shopify and transforms them into a singular SKU.\n\n\
             For example, playpen-mat-balls-blue with "-only mats" option transforms it to "elite-play-mat-v2"\n\
-            Another example, playpen-blue with "-only mats" option will just have the row dropped and ignored (won\'t be put into the JD output)'
+            Another example, playpen-blue with "-only mats" option will just have the row dropped and ignored (won\'t be put into the JD output)\n\
+            --stream reads the shopify export N rows at a time (--chunksize=N, default %d) and writes each chunk straight into a write-only workbook, so huge exports run in bounded memory. Orders are never split across chunks.\n\
+            --index=FNAME_INDEX  sqlite index of every line item already sent to JD (default %s). Line items in it are left out of the output unless their shipping details or quantity changed, so the same cumulative shopify export can be converted again and only the new orders come out. Only those are checked (--report, --quarantine), so an order that was already sent isn\'t warned about or quarantined again.\n\
+            --no-index ignores the index (nothing is skipped or recorded), --rebuild-index forgets everything already sent to JD before converting.\n\
+            --report=FNAME_REPORT  writes every order check finding (order, rule, severity, detail) to FNAME_REPORT, as json if it ends in .json and csv otherwise. Only a one line summary per check is printed.\n\
+            --quarantine=FNAME_QUARANTINE  leaves orders that fail an error check (PO boxes) out of the output and writes their shopify rows to FNAME_QUARANTINE instead, to fix and convert again.\n\
+            --profile prints how long each step took, with the rows that went in and came out of it and the peak memory so far, and writes the same as json next to the output (jd_TIMESTAMP.profile.json).\n\
+            --profile-dump=FNAME_PROF  also writes a cProfile dump of the conversion itself (routing, checks, building both sheets) to FNAME_PROF. Implies --profile.' % (SHOPIFY_CACHE_MAX_BYTES // 2**30, STREAM_CHUNKSIZE, ORDER_INDEX_FNAME)
     print(help_str)
 
-def is_po_box(txt):
-    po_box_detected = False
-    if isinstance(txt,str):
-        po_box_detected = re.search(r'(?:post(?:al)? (?:office )?|p[. ]?o\.? )?box',txt,re.IGNORECASE|re.MULTILINE)
-    return True if po_box_detected else False
-
 def process_args(opts, args):
     jd_fname = None
-    shopify_fname = None
+    shopify_fnames = []
     only_sku_of = None
+    stream = False
+    chunksize = STREAM_CHUNKSIZE
+    index_fname = ORDER_INDEX_FNAME
+    use_index = True
+    rebuild_index = False
+    report_fname = None
+    quarantine_fname = None
+    workers = None
+    profile = False
+    profile_dump_fname = None
+    use_cache = True
     for opt, arg in opts:
         if opt == "-h":
             print_help()
         elif opt in ("-j", "--jd"):
             jd_fname = arg
         elif opt in ("-s", "--shopify"):
-            shopify_fname = arg
+            shopify_fnames.append(arg)
         elif opt in ("-o", "--only"):
             only_sku_of = arg
-    return (jd_fname, shopify_fname, only_sku_of)
-
-def build_items_per_order(items_per_order, curr_row_dict, name):
-    if curr_row_dict['*Quantity'] > 1:
-        print("WARNING FOR ORDER " + name + ": Quantity is more than 1 which means the shipping serivce generated will need to be changed! Surepost_under1lb for one mat only. Surepost_over1lb for over 10lbs only. UPS ground for >1lb, and <10lb")
-    if name not in items_per_order:
-        items_per_order[name] = [curr_row_dict['*Customer SKU ID']]
-    else:
-        items_per_order[name].append(curr_row_dict['*Customer SKU ID'])
-
-def append_df_to_excel(filename, df, sheet_name='Sheet1', startrow=None,
-                       truncate_sheet=False, 
-                       **to_excel_kwargs):
-    """
-    Append a DataFrame [df] to existing Excel file [filename]
-    into [sheet_name] Sheet.
-    If [filename] doesn't exist, then this function will create it.
-
-    @param filename: File path or existing ExcelWriter
-                     (Example: '/path/to/file.xlsx')
-    @param df: DataFrame to save to workbook
-    @param sheet_name: Name of sheet which will contain DataFrame.
-                       (default: 'Sheet1')
-    @param startrow: upper left cell row to dump data frame.
-                     Per default (startrow=None) calculate the last row
-                     in the existing DF and write to the next row...
-    @param truncate_sheet: truncate (remove and recreate) [sheet_name]
-                           before writing DataFrame to Excel file
-    @param to_excel_kwargs: arguments which will be passed to `DataFrame.to_excel()`
-                            [can be a dictionary]
-    @return: None
-
-    Usage examples:
-
-    >>> append_df_to_excel('d:/temp/test.xlsx', df)
-
-    >>> append_df_to_excel('d:/temp/test.xlsx', df, header=None, index=False)
-
-    >>> append_df_to_excel('d:/temp/test.xlsx', df, sheet_name='Sheet2',
-                           index=False)
-
-    >>> append_df_to_excel('d:/temp/test.xlsx', df, sheet_name='Sheet2', 
-                           index=False, startrow=25)
-
-    (c) [MaxU](https://stackoverflow.com/users/5741205/maxu?tab=profile)
-    """
-    # Excel file doesn't exist - saving and exiting
-    if not os.path.isfile(filename):
-        df.to_excel(
-            filename,
-            sheet_name=sheet_name, 
-            startrow=startrow if startrow is not None else 0, 
-            **to_excel_kwargs)
-        return
-    
-    # ignore [engine] parameter if it was passed
-    if 'engine' in to_excel_kwargs:
-        to_excel_kwargs.pop('engine')
-
-    writer = pd.ExcelWriter(filename, engine='openpyxl', mode='a')
-
-    # try to open an existing workbook
-    writer.book = load_workbook(filename)
-    
-    # get the last row in the existing Excel sheet
-    # if it was not specified explicitly
-    if startrow is None and sheet_name in writer.book.sheetnames:
-        startrow = writer.book[sheet_name].max_row
-
-    # truncate sheet
-    if truncate_sheet and sheet_name in writer.book.sheetnames:
-        # index of [sheet_name] sheet
-        idx = writer.book.sheetnames.index(sheet_name)
-        # remove [sheet_name]
-        writer.book.remove(writer.book.worksheets[idx])
-        # create an empty sheet [sheet_name] using old index
-        writer.book.create_sheet(sheet_name, idx)
-    
-    # copy existing sheets
-    writer.sheets = {ws.title:ws for ws in writer.book.worksheets}
-
-    if startrow is None:
-        startrow = 0
-
-    # write out the new sheet
-    df.to_excel(writer, sheet_name, startrow=startrow, **to_excel_kwargs)
-
-    # save the workbook
-    writer.save()
-
-def shop2jd(shop_pd,jd_pd, only_sku_of, outfile):
+        elif opt == "--stream":
+            stream = True
+        elif opt == "--chunksize":
+            chunksize = int(arg)
+        elif opt == "--index":
+            index_fname = arg
+        elif opt == "--no-index":
+            use_index = False
+        elif opt == "--rebuild-index":
+            rebuild_index = True
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--no-cache":
+            use_cache = False
+        elif opt == "--profile":
+            profile = True
+        elif opt == "--profile-dump":
+            profile = True
+            profile_dump_fname = arg
+        elif opt == "--report":
+            report_fname = arg
+        elif opt == "--quarantine":
+            quarantine_fname = arg
+    return (jd_fname, expand_shopify_fnames(shopify_fnames), only_sku_of, stream, chunksize, index_fname, use_index, rebuild_index, report_fname, quarantine_fname, workers, profile, profile_dump_fname, use_cache)
+
+def load_jd_template(jd_fname):
+    jd_pd = template_frames(jd_fname, sheet_name=None)
+    #for some reason this imports a buncha unnamed columns for the first tab, so let's remove it
+    cols_to_del = []
+    for col in jd_pd['Outbound Order Info'].columns:
+        if "Unnamed" in col:
+            cols_to_del.append(col)
+    if cols_to_del:
+        jd_pd['Outbound Order Info'].drop(cols_to_del, axis=1, inplace=True) # don't bother entering this branch of cols_to_del is empty
+    return jd_pd
+
+def load_jd_merged_headers(jd_fname):
+    # the ridiculous merged headers that JD put above the column headers of each sheet, (cell range, title) per
+    # sheet, straight from the template so a new one doesn't end up with the old ranges
+    schema = load_template_schema(jd_fname)
+    return {sheet_name: [tuple(merged) for merged in schema['sheets'][sheet_name]['merged']] for sheet_name in schema['sheet_names']}
+
+def load_sku_weights(fname=SKU_WEIGHTS_FNAME):
+    # per-SKU shipping weight (lbs) and box dimensions (inches), indexed by SKU. bundles are listed with their total weight.
+    import pandas as pd
+    sku_weights = pd.read_csv(fname, index_col='sku')
+    # a SKU sku_routes.csv sends to JD by name is known up front. the ones it passes on as is are only known once the
+    # export is read, build_service_product_info() warns about those
+    weighed = sku_weights['weight_lb'].dropna().index
+    for sku in load_sku_routes().routed_skus():
+        if sku not in weighed:
+            print("WARNING: SKU " + sku + " is routed to JD by " + SKU_ROUTES_FNAME + " but has no weight in " + fname + ", so orders with it will default to UPS ground. Please add it!")
+    return sku_weights
+
+def build_service_product_info(outbound_pd, sku_weights, customer_code):
+    # pick a shipping service per order from the total weight of everything in the order, in one groupby over the outbound sheet.
+    import pandas as pd
+    weights = outbound_pd['*Customer SKU ID'].map(sku_weights['weight_lb'])
+    unknown = weights.isna()
+    for sku in outbound_pd.loc[unknown, '*Customer SKU ID'].unique():
+        print("WARNING: SKU " + str(sku) + " is not in the SKU weight table, so orders with it will default to UPS ground. Please add it to " + SKU_WEIGHTS_FNAME + "!")
+    line_weights = weights.fillna(0) * outbound_pd['*Quantity'].astype(float)
+    per_order = pd.DataFrame({'weight': line_weights, 'unknown': unknown}).groupby(outbound_pd['*Customer Order No.'], sort=False).agg({'weight': 'sum', 'unknown': 'any'})
+
+    # Surepost_under1lb is for under 1lb only (one mat). Surepost_over1lb is for 10lbs and up. UPS ground for everything in between.
+    service = pd.cut(per_order['weight'], bins=service_weight_bins, labels=service_weight_labels, right=False).astype(object)
+    # an order with a SKU we don't know the weight of can't be proven to be under 1lb
+    service[per_order['unknown'] & (service == "Surepost_under1lb")] = "UPS_ground"
+
+    return pd.DataFrame({
+        '*Customer Code': customer_code,
+        '*Customer Order No.': per_order.index,
+        'Service Product Code': service.map(service_map).values,
+        })
+
+def build_jd(paid_pd, jd_pd, only_sku_of, sku_weights=None, checks=None, order_index=None, profiler=NULL_PROFILER):
+    # paid_pd is the paid line items only (see paid_line_items). it isn't modified, so one frame can feed several outputs.
+    import pandas as pd
+    import numpy as np
 #    for col in jd_pd['Outbound Order Info'].columns:
 #        if "Outbound" in col:
 #            print([col])
     customer_code = 'KH20000001629' #constant
-    items_per_order = {}
-    for idx, row in shop_pd.iterrows():
-        if (row['Financial Status']!="paid"):
-            # not paid yet / cancelled / refunded, so we're not gonna order anything for them.
-            continue
-        curr_row_dict = {}
-        # convert all SKUs to the specified accessory
-        # TODO_OPT - when i do a gui have a list of possible items to pick, like "elite-play-mat" "elite-play-mat-v2"
-
-        #curr_row_dict is a dictionary that is a placeholder for the current shopify's .csv row being processed, expressed in terms of the destination .csv file
-        curr_shop_sku = row['Lineitem sku']
-        if only_sku_of=="mats":
-            if "playpen-mat" in curr_shop_sku or "elite-play-mat" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = 'elite-play-mat-v2'
-            else:
-                continue #this order has no mat, so we don't need to fork the mat fulfillment to 3PL, skip this row.
-        elif only_sku_of=="balls":
-            if "playpen-mat-balls" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = 'pitballs-100' #only set of 100 balls comes with the playpen+mat+balls bundle
-            elif "balls" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = curr_shop_sku #if they ordered balls by themselves.
-            else:
-                continue #not part of ppe+mat+balls bundle and customer didn't order balls by themselves, so there's no balls in this order to fork to 3PL.
-        elif only_sku_of=="playpens":
-            if "playpen-mat" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = "playpen-blue" if "blue" in curr_shop_sku else "playpen-red" #only 2 colors for now. #TODO_OPT - change this if >2 colors.
-            elif "playpen" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = curr_shop_sku #not a bundle, so customer just ordered a playpen in which case we just use the SKU customer already has.
-            else:
-                continue #this is a non-playpen order and thus can be skipped.
-        elif only_sku_of!="accessories":
-            curr_row_dict['*Customer SKU ID'] = curr_shop_sku #no SKU filtering needed.
-
-
-        curr_row_dict['*Customer Code'] = customer_code
-        curr_row_dict['*Customer Order No.'] = row['Name']
-        curr_row_dict['* Sales Channel No.'] =  "Playpen Elite" #constant, per sales channel
-        curr_row_dict['*Sales Channel SO No.'] = row['Name'] # Same as customer order no.
-        curr_row_dict['*Cargo Owner Code'] = 19916 #same as cargo owner ID 19916 or is this "Playpen Elite"?
-        curr_row_dict['*Warehouse Code'] =  'C0000000579' #Fontana
-        curr_row_dict['*Order Type\n1-B2C；2-B2B；\n3-WarehouseOnly'] = 1
-
-        curr_row_dict['*Consignee Address1'] = row['Shipping Address1']
-        curr_row_dict['Consignee Address2'] = row['Shipping Address2']
-        #curr_row_dict['ShipToEmail'] = row['Email']
-        curr_row_dict['*Consignee Name'] = row['Shipping Name'].lstrip().rstrip()
-        #county needed?
-        curr_row_dict['*Consignee City'] = row['Shipping City'].lstrip().rstrip()
-        curr_row_dict['*Consignee State/Province'] = row['Shipping Province'].lstrip().rstrip()
-        curr_row_dict['*Consignee Postcode'] = row['Shipping Zip']
-        curr_row_dict['*Consignee Country'] = row['Shipping Country'].lstrip().rstrip()
-        curr_row_dict['*Consignee District/County'] = "US"
-        curr_row_dict['*Price'] = 1 # just a constant
-        curr_row_dict['*Outbound Unit\n1-piece；2-Box；3-Pallet'] = 1 # Always 1 since we're b2c.
-
-        phone = row['Shipping Phone']
-        phone = phone.replace("(","").replace(")","").replace(" ","").replace("-","")
-        if len(phone) == 11:
-            phone = phone[1:]
-        curr_row_dict['*Mobile'] = phone
-        curr_row_dict['*Quantity'] = row['Lineitem quantity']
-        if len(phone) <10 or len(phone)>11:
-            print("MAKE SURE PHONE NUMBER FOR ORDER: " + row['Name'] + " is correct! It has " + str(len(phone)) + " digits!")
-
-        # various warning checks for orders
-        if (row['Risk Level']!="Low"):
-            # TODO_OPT - just auto-drop medium or high risk orders??
-            print("WARNING: Order " + row['Name'] + " has a \"" + row['Risk Level'] + "\" risk level! Please make sure this is something we want to import and not delete!")
-        if (is_po_box(row['Shipping Address1']) or is_po_box(row['Shipping Address2'])):
-            print("WARNING, ORDER " + row['Name'] + " HAS A PO BOX. WE CANNOT SHIP TO PO BOXES. PLEASE FIX THIS BEFORE IMPORTING IT TO JD!!!")
-
-        curr_name = row['Name']
-        if only_sku_of=="accessories": 
-            if "playpen-mat" in curr_shop_sku or "elite-play-mat" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = 'elite-play-mat-v2' #there is at least a mat in the order
-                jd_pd['Outbound Order Info'] = jd_pd['Outbound Order Info'].append(curr_row_dict, ignore_index=True)
-                build_items_per_order(items_per_order, curr_row_dict, curr_name)
-            if "playpen-mat-balls" in curr_shop_sku or "pitballs-100" in curr_shop_sku:
-                curr_row_dict['*Customer SKU ID'] = 'pitballs-100' #there are balls in the order.
-                jd_pd['Outbound Order Info'] = jd_pd['Outbound Order Info'].append(curr_row_dict, ignore_index=True)
-                build_items_per_order(items_per_order, curr_row_dict, curr_name)
-            continue # don't double push
-
-        # build a dictionary of Order # -> Items to determine shipping service later.
-        build_items_per_order(items_per_order, curr_row_dict, curr_name)
-
-        jd_pd['Outbound Order Info'] = jd_pd['Outbound Order Info'].append(curr_row_dict, ignore_index=True)
-
-    service_map = {
-            "Surepost_under1lb" : "SPB9900hf",
-            "Surepost_over1lb" : "SPB9900he",
-            "UPS_ground" : "SPB99008u",
-            }
-    service_row = {}
-    # work on second sheet, where we create shipping service based on weight
-    for order in items_per_order:
-        service_row['*Customer Code'] = customer_code
-        service_row['*Customer Order No.'] = order
-        items = items_per_order[order]
-        if len(items) == 1:
-            if 'elite-play-mat' in items[0]:
-                # some mat, use Surepost_under1lb
-                service_row['Service Product Code'] = service_map['Surepost_under1lb']
-            elif 'playpen' in items[0]:
-                # some playpen or playpen bundle, so >10lb and use Surepost_over1lb
-                service_row['Service Product Code'] = service_map['Surepost_over1lb']
-            else:
-                # balls, so use UPS ground
-                service_row['Service Product Code'] = service_map['UPS_ground']
-        elif len(items) == 2:
-            # either do UPS_ground or Surepost_over1lb (i.e. over 10lbs) as it is >1lb, and will be <10lb if no playpen is included or >=10lb if playpen is included
-            if 'playpen-blue' in items or 'playpen-red' in items or 'playpen-mat-balls-blue' in items or 'playpen-mat-balls-red' in items or 'playpen-mat-blue' in items or 'playpen-mat-red' in items:
-                # use Surepost_over1lb (>10lb)
-                service_row['Service Product Code'] = service_map['Surepost_over1lb']
-            elif ('elite-play-mat-v2' in items and 'pitballs-100' in items) or ('elite-play-mat' in items and 'pitballs-100' in items):
-                # use UPS_ground (>1lb, but <10lb)
-                service_row['Service Product Code'] = service_map['UPS_ground']
-            else:
-                print("Unexpected items for order: " + str(order) + " -- Items: " + str(items))
-                sys.exit(2)
-        else:
-            #use UPS_Ground for simplicity
-            service_row['Service Product Code'] = service_map['UPS_ground']
-            print("Double check for order: " + str(order) + " to make sure that UPS ground is correct and it won't be over 10lbs (i.e. we should change it to Surepost_over1lb")
-
-        jd_pd['Service Product Info'] = jd_pd['Service Product Info'].append(service_row, ignore_index=True)
-
-    # need to open .xlsx file to write the ridiculous merge headers that JD put in.
-    workbook = xlsxwriter.Workbook(outfile)
-    outbound_order_info_ws = workbook.add_worksheet('Outbound Order Info')
-    service_product_info_ws = workbook.add_worksheet('Service Product Info')
-    merge_format = workbook.add_format({'align': 'center'})
-    outbound_order_info_ws.merge_range('A1:L1', 'Outbound Order Info', merge_format)
-    outbound_order_info_ws.merge_range('M1:Y1', 'Consignee Info', merge_format)
-    outbound_order_info_ws.merge_range('Z1:AC1', 'Product Info', merge_format)
-    service_product_info_ws.merge_range('A1:B1', 'Outbound Order Info', merge_format)
-    service_product_info_ws.merge_range('C1:F1', 'Service Product Info', merge_format)
-
-    workbook.close()
-
+    jd_pd = dict(jd_pd) # new sheets go in a copy so the caller's template can be reused
+    if sku_weights is None:
+        sku_weights = load_sku_weights()
+
+    # convert all SKUs to the specified accessory. rows with no SKU for this mode are dropped, and bundles
+    # with more than one SKU for this mode (like mat + balls for accessories) become one row per SKU. new colors and bundles go in sku_routes.csv.
+    # TODO_OPT - when i do a gui have a list of possible items to pick, like "elite-play-mat" "elite-play-mat-v2"
+    output = "jd[" + (only_sku_of or "all") + "]"
+    with profiler.stage("route " + output, len(paid_pd)) as stage:
+        paid_pd = load_sku_routes().route_frame(paid_pd, only_sku_of)
+        stage.rows_out = len(paid_pd)
+    if order_index is not None:
+        # leave out whatever an earlier run already sent to JD
+        with profiler.stage("order index " + output, len(paid_pd)) as stage:
+            paid_pd, line_items = order_index.select_new(paid_pd, "jd")
+            stage.rows_out = len(paid_pd)
+    if checks is not None:
+        # after the index, so orders that were already sent aren't warned about or quarantined again
+        with profiler.stage("checks " + output, len(paid_pd)) as stage:
+            kept = checks.kept(paid_pd, clean_phone(paid_pd['Shipping Phone']))
+            paid_pd = paid_pd[kept]
+            stage.rows_out = len(paid_pd)
+        if order_index is not None:
+            line_items = list(compress(line_items, kept))
+    if order_index is not None:
+        # only what's left, so quarantined orders aren't recorded as sent
+        order_index.add_pending("jd", line_items)
 
     #replace dataframe's NANs with empty string, as empty cells are NaNs
-    jd_pd['Outbound Order Info']=jd_pd['Outbound Order Info'].replace(np.nan, '', regex=True)
-    jd_pd['Service Product Info']=jd_pd['Service Product Info'].replace(np.nan, '', regex=True)
+    with profiler.stage("build " + output, len(paid_pd)) as stage:
+        rows_pd = outbound_rows(paid_pd, customer_code)
+        jd_pd['Outbound Order Info'] = pd.concat([jd_pd['Outbound Order Info'], rows_pd], ignore_index=True).replace(np.nan, '', regex=True)
+        stage.rows_out = len(rows_pd)
+    # work on second sheet, where we create shipping service based on weight
+    with profiler.stage("service products " + output, len(rows_pd)) as stage:
+        service_pd = build_service_product_info(rows_pd, sku_weights, customer_code)
+        jd_pd['Service Product Info'] = pd.concat([jd_pd['Service Product Info'], service_pd], ignore_index=True).replace(np.nan, '', regex=True)
+        stage.rows_out = len(service_pd)
+    return jd_pd
+
+def outbound_rows(paid_pd, customer_code):
+    # constants are broadcast down the whole column by the DataFrame constructor
+    import pandas as pd
+    phones = clean_phone(paid_pd['Shipping Phone']).to_numpy()
+    return pd.DataFrame({
+        '*Customer Code': customer_code,
+        '*Customer Order No.': paid_pd['Name'],
+        '* Sales Channel No.': "Playpen Elite", #constant, per sales channel
+        '*Sales Channel SO No.': paid_pd['Name'], # Same as customer order no.
+        '*Cargo Owner Code': 19916, #same as cargo owner ID 19916 or is this "Playpen Elite"?
+        '*Warehouse Code': 'C0000000579', #Fontana
+        '*Order Type\n1-B2C；2-B2B；\n3-WarehouseOnly': 1,
+        '*Consignee Address1': paid_pd['Shipping Address1'],
+        'Consignee Address2': paid_pd['Shipping Address2'],
+        '*Consignee Name': paid_pd['Shipping Name'].str.strip(),
+        #county needed?
+        '*Consignee City': paid_pd['Shipping City'].str.strip(),
+        '*Consignee State/Province': paid_pd['Shipping Province'].str.strip(),
+        '*Consignee Postcode': clean_zip(paid_pd['Shipping Zip']),
+        '*Consignee Country': paid_pd['Shipping Country'].str.strip(),
+        '*Consignee District/County': "US",
+        '*Price': 1, # just a constant
+        '*Outbound Unit\n1-piece；2-Box；3-Pallet': 1, # Always 1 since we're b2c.
+        '*Mobile': phones,
+        '*Customer SKU ID': paid_pd[ROUTED_SKU],
+        '*Quantity': paid_pd['Lineitem quantity'],
+        })
+
+def shop2jd(shop_pd,jd_pd, merged_headers, only_sku_of, outfile, sku_weights=None, order_index=None, checks=None, profiler=NULL_PROFILER):
+    if checks is None:
+        checks = OrderChecks(JD_CHECKS, "JD")
+    with profiler.stage("paid filter", len(shop_pd)) as stage:
+        paid_pd = paid_line_items(shop_pd)
+        stage.rows_out = len(paid_pd)
+    with profiler.cprofile():
+        jd_pd = build_jd(paid_pd, jd_pd, only_sku_of, sku_weights, checks, order_index, profiler)
+    with profiler.stage("write", len(jd_pd['Outbound Order Info'])):
+        write_jd(jd_pd, outfile, merged_headers)
+    if order_index is not None:
+        # only once the output is written, so a failed run sends the same orders next time
+        with profiler.stage("order index commit"):
+            order_index.commit(outfile)
+    with profiler.stage("checks report"):
+        checks.finish()
+
+def write_jd(jd_pd, outfile, merged_headers):
+    # both sheets, JD's ridiculous merged headers (see load_jd_merged_headers) and all the rows go out in a single pass
+    writer = JDWorkbookWriter(outfile, jd_pd, merged_headers)
+    for sheet_name in merged_headers:
+        writer.append(sheet_name, jd_pd[sheet_name])
+    writer.close()
+
+class JDWorkbookWriter:
+    # writes the JD workbook top to bottom in one pass through xlsxwriter's constant_memory mode, which
+    # flushes every finished row to disk. rows have to be appended in order, per sheet.
+    def __init__(self, outfile, jd_pd, merged_headers):
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(outfile, {'constant_memory': True})
+        merge_format = self.workbook.add_format({'align': 'center'})
+        # same look as the header row pandas' to_excel writes
+        header_format = self.workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        self.sheets = {}
+        self.columns = {}
+        self.next_row = {}
+        for sheet_name in merged_headers:
+            ws = self.workbook.add_worksheet(sheet_name)
+            for cell_range, title in merged_headers[sheet_name]:
+                ws.merge_range(cell_range, title, merge_format)
+            self.columns[sheet_name] = list(jd_pd[sheet_name].columns)
+            for col, header in enumerate(self.columns[sheet_name]):
+                ws.write_string(1, col, header, header_format)
+            self.sheets[sheet_name] = ws
+            self.next_row[sheet_name] = 2
+
+    def append(self, sheet_name, df):
+        import numpy as np
+        ws = self.sheets[sheet_name]
+        row = self.next_row[sheet_name]
+        df = df.reindex(columns=self.columns[sheet_name])
+        for values in zip(*(df[col].tolist() for col in df.columns)):
+            for col, value in enumerate(values):
+                if isinstance(value, np.generic):
+                    value = value.item()
+                if isinstance(value, str):
+                    if value != '': # leave empty cells empty
+                        # never as a formula or a link, even if it looks like one
+                        ws.write_string(row, col, value)
+                elif isinstance(value, bool):
+                    ws.write_boolean(row, col, value)
+                elif isinstance(value, (int, float)) and value == value: # NaN != NaN, and is left empty too
+                    ws.write_number(row, col, value)
+                elif value is not None and value == value:
+                    ws.write(row, col, value)
+            row += 1
+        self.next_row[sheet_name] = row
+
+    def close(self):
+        self.workbook.close()
+
+def shop2jd_stream(shopify_fnames, jd_pd, merged_headers, only_sku_of, outfile, sku_weights=None, chunksize=STREAM_CHUNKSIZE, order_index=None, checks=None, profiler=NULL_PROFILER, use_cache=True):
+    # convert the shopify exports a chunk of whole orders at a time, writing each chunk straight into the workbook
+    # so memory stays bounded by the chunk size instead of the export size.
+    if sku_weights is None:
+        sku_weights = load_sku_weights()
+    if checks is None:
+        checks = OrderChecks(JD_CHECKS, "JD")
+    writer = JDWorkbookWriter(outfile, jd_pd, merged_headers)
+    for paid_pd in profiler.iterate("read shopify + paid filter", read_shopify_files_chunks(shopify_fnames, chunksize, use_cache)):
+        with profiler.cprofile():
+            chunk_pd = build_jd(paid_pd, jd_pd, only_sku_of, sku_weights, checks, order_index, profiler)
+        with profiler.stage("write", len(chunk_pd['Outbound Order Info'])):
+            for sheet_name in merged_headers:
+                writer.append(sheet_name, chunk_pd[sheet_name])
+        jd_pd = {sheet_name: jd_pd[sheet_name].iloc[0:0] for sheet_name in jd_pd} # only write the template's own rows once
+    with profiler.stage("write"):
+        writer.close()
+    if order_index is not None:
+        with profiler.stage("order index commit"):
+            order_index.commit(outfile)
+    with profiler.stage("checks report"):
+        checks.finish()
 
-    append_df_to_excel(outfile, jd_pd['Outbound Order Info'], sheet_name='Outbound Order Info', startrow=1, index=False)
-    append_df_to_excel(outfile, jd_pd['Service Product Info'], sheet_name='Service Product Info', startrow=1, index=False)
-    #jd_pd['Outbound Order Info'].to_excel(writer,startrow=1,sheet_name='Outbound Order Info',index=False)
-    #jd_pd['Service Product Info'].to_excel(writer,startrow=1,sheet_name='Service Product Info',index=False)
-    
 if __name__ == "__main__":
     # take in commandline arguments
     argv = sys.argv[1:]
     try:
-        opts, args = getopt.getopt(argv,"hj:s:o:",["--jd=","--shopify=","--only="])
+        opts, args = getopt.getopt(argv,"hj:s:o:",["jd=","shopify=","only=","stream","chunksize=","index=","no-index","rebuild-index","report=","quarantine=","workers=","no-cache","profile","profile-dump="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
 
     #run through each arg from commandline
-    jd_fname, shopify_fname, only_sku_of= process_args(opts, args)
+    jd_fname, shopify_fnames, only_sku_of, stream, chunksize, index_fname, use_index, rebuild_index, report_fname, quarantine_fname, workers, profile, profile_dump_fname, use_cache = process_args(opts, args)
 
     # generate pd from jd and shopify data
-    if (shopify_fname is None):
+    if not shopify_fnames:
         print_help()
         print("--shopify= option is missing")
         sys.exit(2)
@@ -303,19 +330,23 @@ if __name__ == "__main__":
         print ("-j argument (--jd=) argument is missing. Please use -j to specify which .xlsx is the JD template file")
         sys.exit(2)
         # just use the -j argument for the template file.
-    jd_pd = pd.read_excel(open(jd_fname,'rb'), sheet_name=None, header=1)
-    #for some reason this imports a buncha unnamed columns for the first tab, so let's remove it
-    cols_to_del = []
-    for col in jd_pd['Outbound Order Info'].columns:
-        if "Unnamed" in col:
-            cols_to_del.append(col)
-    if cols_to_del:
-        jd_pd['Outbound Order Info'].drop(cols_to_del, axis=1, inplace=True) # don't bother entering this branch of cols_to_del is empty
+    profiler = StageProfiler(profile, profile_dump_fname) if profile else NULL_PROFILER
+    with profiler.stage("template"):
+        jd_pd = load_jd_template(jd_fname)
+        merged_headers = load_jd_merged_headers(jd_fname)
+    checks = OrderChecks(JD_CHECKS, "JD", report_fname, quarantine_fname)
+    order_index = open_order_index(index_fname, use_index, ["jd"] if rebuild_index else [])
 
-    shop_pd = pd.read_csv(shopify_fname)
-        
     # convert shopify to jd
     timestamp = time.strftime('%m-%d_%H%M%S', time.localtime())
     #TODO_OPT add a cmdline option for output file
-    shop2jd(shop_pd=shop_pd,jd_pd=jd_pd, only_sku_of=only_sku_of, outfile="jd_"+timestamp+".xlsx")
+    outfile = "jd_"+timestamp+".xlsx"
+    if stream:
+        shop2jd_stream(shopify_fnames=shopify_fnames, jd_pd=jd_pd, merged_headers=merged_headers, only_sku_of=only_sku_of, outfile=outfile, chunksize=chunksize, order_index=order_index, checks=checks, profiler=profiler, use_cache=use_cache)
+    else:
+        with profiler.stage("read shopify") as stage:
+            shop_pd = read_shopify_files(shopify_fnames, workers, use_cache)
+            stage.rows_out = len(shop_pd)
+        shop2jd(shop_pd=shop_pd,jd_pd=jd_pd, merged_headers=merged_headers, only_sku_of=only_sku_of, outfile=outfile, order_index=order_index, checks=checks, profiler=profiler)
+    profiler.finish(profile_trace_fname(outfile))
     #TODO_OPT refactor this to be JD and VERDE orthogonally as options.
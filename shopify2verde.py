@@ -1,154 +1,307 @@
-import pandas as pd
-import requests
 import csv
 import os
 import sys,getopt
 import time
-import numpy as np
-import re
+from itertools import compress
+from shopify_loader import read_shopify_files, read_shopify_files_chunks, read_shopify_rows, expand_shopify_fnames, paid_line_items, paid_rows, STREAM_CHUNKSIZE
+from shopify_cache import SHOPIFY_CACHE_MAX_BYTES
+from sku_routes import load_sku_routes, ROUTED_SKU
+from order_checks import OrderChecks, VERDE_CHECKS
+from order_index import open_order_index, ORDER_INDEX_FNAME
+from stage_profile import StageProfiler, NULL_PROFILER, profile_trace_fname
+from template_cache import load_template_schema, template_frames
+from shipping_fields import clean_phone, clean_phone_text, clean_zip, clean_zip_text
+
+# exports with up to this many rows are converted with just the csv module. importing pandas alone takes longer
+# than converting a few thousand rows without it, and it's still a bit faster at 20k rows, even from the cache. see --fast-rows
+FAST_ROWS = 20000
 
 def print_help():
-    help_str=' python shopify2verde.py -v FNAME_VERDE -s FNAME_SHOPIFY [-o SKUOPTION] \n\
-            -v FNAME_VERDE  (--verde=FNAME_VERDE) where FNAME_VERDE is the path to the VERDE template .csv file. Should just be this file: https://secure-wms.com/ViaSub.WMS/ImportFiles/Order%20Import%20Template.xlsx. The script will *TRY* to download this file but if the URL has changed, you will need to have a copy of it in your local area.\n\
-            -s FNAME_SHOPIFY (--shopify==FNAME_SHOPIFY) where FNAME_SHOPIFY is the path to the SHOPIFY template .csv file\n\
-            -o SKUOPTION (--only=SKUOPTION) can be "mats" "playpens" "balls" "accessories", filters out sku list from shopify and transforms them into a singular SKU.\n\n\
+    help_str=' python shopify2verde.py -v FNAME_VERDE -s FNAME_SHOPIFY [-s FNAME_SHOPIFY ...] [-o SKUOPTION] [--workers=N] [--no-cache] [--fast-rows=N] [--stream [--chunksize=N]] [--index=FNAME_INDEX | --no-index | --rebuild-index] [--report=FNAME_REPORT] [--quarantine=FNAME_QUARANTINE] [--profile [--profile-dump=FNAME_PROF]] \n\
+            -v FNAME_VERDE  (--verde=FNAME_VERDE) where FNAME_VERDE is the path to the VERDE template .csv file. Should just be this file: https://secure-wms.com/ViaSub.WMS/ImportFiles/Order%%20Import%%20Template.xlsx. The script will *TRY* to download this file but if the URL has changed, you will need to have a copy of it in your local area.\n\
+            -s FNAME_SHOPIFY (--shopify==FNAME_SHOPIFY) where FNAME_SHOPIFY is the path to the SHOPIFY template .csv file. Can be given more than once, as a comma separated list or as a glob like "orders_*.csv" to convert several (overlapping) exports into one output. Line items that are in more than one of them (same Name and Lineitem sku) are only converted once.\n\
+            --workers=N  how many exports to parse at the same time when there is more than one (default: one per core)\n\
+            --no-cache  always parse the shopify exports. Normally a parsed export is kept in .3pl_cache/shopify/ (needs pyarrow), keyed by what is in the file, and converting the same file again (in any mode, to any 3PL) loads it from there instead. The least recently used ones are deleted past %d GB.\n\
+            --fast-rows=N  a single export of up to N rows (default %d) is converted with python\'s csv module instead of pandas, which takes longer to import than the whole conversion takes. The output is the same. 0 always uses pandas, and so do --stream, --quarantine and --profile.\n\
+            -o SKUOPTION (--only=SKUOPTION) can be "mats" "playpens" "balls" "accessories" (or any other mode in sku_routes.csv), filters out sku list from shopify and transforms them into a singular SKU.\n\n\
             For example, playpen-mat-balls-blue with "-only mats" option transforms it to "elite-play-mat-v2"\n\
-            Another example, playpen-blue with "-only mats" option will just have the row dropped and ignored (won\'t be put into the verde output)'
+            Another example, playpen-blue with "-only mats" option will just have the row dropped and ignored (won\'t be put into the verde output)\n\
+            --stream reads the shopify export N rows at a time (--chunksize=N, default %d) and writes each chunk straight to the output, so huge exports run in bounded memory. Orders are never split across chunks.\n\
+            --index=FNAME_INDEX  sqlite index of every line item already sent to verde (default %s). Line items in it are left out of the output unless their shipping details or quantity changed, so the same cumulative shopify export can be converted again and only the new orders come out. Only those are checked (--report, --quarantine), so an order that was already sent isn\'t warned about or quarantined again.\n\
+            --no-index ignores the index (nothing is skipped or recorded), --rebuild-index forgets everything already sent to verde before converting.\n\
+            --report=FNAME_REPORT  writes every order check finding (order, rule, severity, detail) to FNAME_REPORT, as json if it ends in .json and csv otherwise. Only a one line summary per check is printed.\n\
+            --quarantine=FNAME_QUARANTINE  leaves orders that fail an error check (PO boxes) out of the output and writes their shopify rows to FNAME_QUARANTINE instead, to fix and convert again.\n\
+            --profile prints how long each step took, with the rows that went in and came out of it and the peak memory so far, and writes the same as json next to the output (verde_TIMESTAMP.profile.json).\n\
+            --profile-dump=FNAME_PROF  also writes a cProfile dump of the conversion itself (routing, checks, building the rows) to FNAME_PROF. Implies --profile.' % (SHOPIFY_CACHE_MAX_BYTES // 2**30, FAST_ROWS, STREAM_CHUNKSIZE, ORDER_INDEX_FNAME)
     print(help_str)
 
-def is_po_box(txt):
-    po_box_detected = False
-    if isinstance(txt,str):
-        po_box_detected = re.search(r'(?:post(?:al)? (?:office )?|p[. ]?o\.? )?box',txt,re.IGNORECASE|re.MULTILINE)
-    return True if po_box_detected else False
-
 def process_args(opts, args):
     verde_fname = None
-    shopify_fname = None
+    shopify_fnames = []
     only_sku_of = None
+    stream = False
+    chunksize = STREAM_CHUNKSIZE
+    index_fname = ORDER_INDEX_FNAME
+    use_index = True
+    rebuild_index = False
+    report_fname = None
+    quarantine_fname = None
+    workers = None
+    profile = False
+    profile_dump_fname = None
+    use_cache = True
+    fast_rows = FAST_ROWS
     for opt, arg in opts:
         if opt == "-h":
             print_help()
         elif opt in ("-v", "--verde"):
             verde_fname = arg
         elif opt in ("-s", "--shopify"):
-            shopify_fname = arg
+            shopify_fnames.append(arg)
         elif opt in ("-o", "--only"):
             only_sku_of = arg
-    return (verde_fname, shopify_fname, only_sku_of)
+        elif opt == "--stream":
+            stream = True
+        elif opt == "--chunksize":
+            chunksize = int(arg)
+        elif opt == "--index":
+            index_fname = arg
+        elif opt == "--no-index":
+            use_index = False
+        elif opt == "--rebuild-index":
+            rebuild_index = True
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--no-cache":
+            use_cache = False
+        elif opt == "--fast-rows":
+            fast_rows = int(arg)
+        elif opt == "--profile":
+            profile = True
+        elif opt == "--profile-dump":
+            profile = True
+            profile_dump_fname = arg
+        elif opt == "--report":
+            report_fname = arg
+        elif opt == "--quarantine":
+            quarantine_fname = arg
+    return (verde_fname, expand_shopify_fnames(shopify_fnames), only_sku_of, stream, chunksize, index_fname, use_index, rebuild_index, report_fname, quarantine_fname, workers, profile, profile_dump_fname, use_cache, fast_rows)
 
 
-def download_verde_template(verde_xlsx_fname):
+def download_verde_template(verde_xlsx_fname, local_fname=None):
+    # local_fname is a copy of the template we already have, to use instead of downloading it
     if not os.path.isfile("./"+verde_xlsx_fname):
-        verde_order_template = "https://secure-wms.com/ViaSub.WMS/ImportFiles/Order%20Import%20Template.xlsx"
-        verde_template_content = requests.get(verde_order_template).content
+        if local_fname is not None:
+            verde_template_content = open(local_fname,'rb').read()
+        else:
+            verde_order_template = "https://secure-wms.com/ViaSub.WMS/ImportFiles/Order%20Import%20Template.xlsx"
+            import requests
+            response = requests.get(verde_order_template)
+            # an error page saved as the template would break this run and every run after it
+            if not response.ok:
+                print("Could not download the verde template from " + verde_order_template + " (HTTP " + str(response.status_code) + "). Download it yourself and pass it with -v")
+                sys.exit(1)
+            verde_template_content = response.content
         output = open(verde_xlsx_fname,'wb')
         output.write(verde_template_content)
         output.close()
+    # parse it once now so every run after this one gets the columns from the template cache
+    load_template_schema(verde_xlsx_fname)
+
+def verde_template_fname(verde_fname=None):
+    if (verde_fname is None):
+        #download verde .xlsx if no -v argument
+        verde_fname = "verde_template.xlsx"
+        download_verde_template(verde_fname)
+    return verde_fname
+
+def load_verde_template(verde_fname=None):
+    return template_frames(verde_template_fname(verde_fname))
+
+def verde_template_columns(verde_fname=None):
+    # the columns of load_verde_template(), without pandas. None if the template has rows of its own
+    schema = load_template_schema(verde_template_fname(verde_fname))
+    sheet = schema['sheets'][schema['sheet_names'][0]]
+    return None if sheet['data_rows'] else sheet['columns']
+
+def build_verde(paid_pd, verde_pd, only_sku_of, checks=None, order_index=None, profiler=NULL_PROFILER):
+    # paid_pd is the paid line items only (see paid_line_items). it isn't modified, so one frame can feed several outputs.
+    # convert all SKUs to the specified accessory. rows with no SKU for this mode are dropped, and bundles
+    # with more than one SKU for this mode (like mat + balls for accessories) become one row per SKU. new colors and bundles go in sku_routes.csv.
+    # TODO - when i do a gui have a list of possible items to pick, like "elite-play-mat" "elite-play-mat-v2"
+    output = "verde[" + (only_sku_of or "all") + "]"
+    with profiler.stage("route " + output, len(paid_pd)) as stage:
+        paid_pd = load_sku_routes().route_frame(paid_pd, only_sku_of)
+        stage.rows_out = len(paid_pd)
+    if order_index is not None:
+        # leave out whatever an earlier run already sent to verde
+        with profiler.stage("order index " + output, len(paid_pd)) as stage:
+            paid_pd, line_items = order_index.select_new(paid_pd, "verde")
+            stage.rows_out = len(paid_pd)
+    if checks is not None:
+        # after the index, so orders that were already sent aren't warned about or quarantined again
+        with profiler.stage("checks " + output, len(paid_pd)) as stage:
+            kept = checks.kept(paid_pd)
+            paid_pd = paid_pd[kept]
+            stage.rows_out = len(paid_pd)
+        if order_index is not None:
+            line_items = list(compress(line_items, kept))
+    if order_index is not None:
+        # only what's left, so quarantined orders aren't recorded as sent
+        order_index.add_pending("verde", line_items)
+
+    with profiler.stage("build " + output, len(paid_pd)) as stage:
+        verde_pd = verde_rows(paid_pd, verde_pd)
+        stage.rows_out = len(verde_pd)
+    return verde_pd
 
-def shop2verde(shop_pd,verde_pd, only_sku_of, outfile):
-    shop_pd['Shipping Zip']=shop_pd['Shipping Zip'].astype(str).str.zfill(5)
-    for idx, row in shop_pd.iterrows():
-        if (row['Financial Status']!="paid"):
-            # not paid yet / cancelled / refunded, so we're not gonna order anything for them.
-            continue
-        curr_row_dict = {}
-        # convert all SKUs to the specified accessory
-        # TODO - when i do a gui have a list of possible items to pick, like "elite-play-mat" "elite-play-mat-v2"
-        curr_shop_sku = row['Lineitem sku']
-        if only_sku_of=="mats":
-            if "playpen-mat" in curr_shop_sku or "elite-play-mat" in curr_shop_sku:
-                curr_row_dict['SKU'] = 'elite-play-mat-v2'
-            else:
-                continue #this order has no mat, so we don't need to fork the mat fulfillment to 3PL, skip this row.
-        elif only_sku_of=="balls":
-            if "playpen-mat-balls" in curr_shop_sku:
-                curr_row_dict['SKU'] = 'pitballs-100' #only set of 100 balls comes with the playpen+mat+balls bundle
-            elif "balls" in curr_shop_sku:
-                curr_row_dict['SKU'] = curr_shop_sku #if they ordered balls by themselves.
-            else:
-                continue #not part of ppe+mat+balls bundle and customer didn't order balls by themselves, so there's no balls in this order to fork to 3PL.
-        elif only_sku_of=="playpens":
-            if "playpen-mat" in curr_shop_sku:
-                curr_row_dict['SKU'] = "playpen-blue" if "blue" in curr_shop_sku else "playpen-red" #only 2 colors for now. #TODO - change this if >2 colors.
-            elif "playpen" in curr_shop_sku:
-                curr_row_dict['SKU'] = curr_shop_sku #not a bundle, so customer just ordered a playpen in which case we just use the SKU customer already has.
-            else:
-                continue #this is a non-playpen order and thus can be skipped.
-        elif only_sku_of!="accessories":
-            curr_row_dict['SKU'] = curr_shop_sku #no SKU filtering needed.
-
-
-        curr_row_dict['ReferenceNumber'] = row['Name']
-        curr_row_dict['ShipCarrier'] = "RateShop"
-        curr_row_dict['ShipService'] = "RateShop w/SmartPost- RS01"
-        curr_row_dict['ShipToAddress1'] = row['Shipping Address1']
-        curr_row_dict['ShipToAddress2'] = row['Shipping Address2']
-        curr_row_dict['ShipToEmail'] = row['Email']
-        curr_row_dict['ShipTo Name'] = row['Shipping Name']
-
-        curr_row_dict['ShipToCity'] = row['Shipping City']
-        curr_row_dict['ShipToState'] = row['Shipping Province']
-        curr_row_dict['ShipToZip'] = row['Shipping Zip']
-        curr_row_dict['ShipToCountry'] = row['Shipping Country']
-        phone = str(row['Shipping Phone'])
-        phone = phone.replace("(","").replace(")","").replace(" ","").replace("-","")
-        if len(phone) == 11:
-            phone = phone[1:]
-        curr_row_dict['ShipToPhone'] = phone
-        curr_row_dict['Quantity'] = row['Lineitem quantity']
-
-        # various warning checks for orders
-        if (row['Risk Level']!="Low"):
-            # TODO - just auto-drop medium or high risk orders??
-            print("WARNING: Order " + row['Name'] + " has a \"" + row['Risk Level'] + "\" risk level! Please make sure this is something we want to import and not delete!")
-        if (is_po_box(row['Shipping Address1']) or is_po_box(row['Shipping Address2'])):
-            print("WARNING, ORDER " + row['Name'] + " HAS A PO BOX. WE CANNOT SHIP TO PO BOXES. PLEASE FIX THIS BEFORE IMPORTING IT TO VERDE!!!")
-
-        if only_sku_of=="accessories": 
-            if "playpen-mat" in curr_shop_sku or "elite-play-mat" in curr_shop_sku:
-                curr_row_dict['SKU'] = 'elite-play-mat-v2' #there is at least a mat in the order
-                verde_pd = verde_pd.append(curr_row_dict, ignore_index=True)
-            if "playpen-mat-balls" in curr_shop_sku or "pitballs-100" in curr_shop_sku:
-                curr_row_dict['SKU'] = 'pitballs-100' #there are balls in the order.
-                verde_pd = verde_pd.append(curr_row_dict, ignore_index=True)
-            continue # don't double push
-        verde_pd = verde_pd.append(curr_row_dict, ignore_index=True)
+def verde_rows(paid_pd, verde_pd):
+    import pandas as pd
+    import numpy as np
+    rows_pd = pd.DataFrame({
+        'ReferenceNumber': paid_pd['Name'],
+        'ShipCarrier': "RateShop",
+        'ShipService': "RateShop w/SmartPost- RS01",
+        'ShipToAddress1': paid_pd['Shipping Address1'],
+        'ShipToAddress2': paid_pd['Shipping Address2'],
+        'ShipToEmail': paid_pd['Email'],
+        'ShipTo Name': paid_pd['Shipping Name'],
+        'ShipToCity': paid_pd['Shipping City'],
+        'ShipToState': paid_pd['Shipping Province'],
+        'ShipToZip': clean_zip(paid_pd['Shipping Zip']),
+        'ShipToCountry': paid_pd['Shipping Country'],
+        'ShipToPhone': clean_phone(paid_pd['Shipping Phone']),
+        'SKU': paid_pd[ROUTED_SKU],
+        'Quantity': paid_pd['Lineitem quantity'],
+        })
+
+    verde_pd = pd.concat([verde_pd, rows_pd], ignore_index=True)
 
     #replace dataframe's NANs with empty string, as empty cells are NaNs
-    verde_pd=verde_pd.replace(np.nan, '', regex=True)
+    return verde_pd.replace(np.nan, '', regex=True)
+
+def build_verde_rows(paid_rows, columns, only_sku_of, checks=None, order_index=None):
+    # build_verde() of a small export read by read_shopify_rows(): the same routing, checks and order index, and
+    # the same rows out, as lists of text in the template's column order (see verde_template_columns())
+    rows = load_sku_routes().route_rows(paid_rows, only_sku_of)
+    if order_index is not None:
+        rows, line_items = order_index.select_new_rows(rows, "verde")
+    if checks is not None:
+        rows = checks.check_rows(rows)
+    if order_index is not None:
+        # check_rows() never takes anything out
+        order_index.add_pending("verde", line_items)
+    return [verde_row(row, columns) for row in rows]
+
+def verde_row(row, columns):
+    # verde_rows() of one row dict
+    values = {
+        'ReferenceNumber': row['Name'],
+        'ShipCarrier': "RateShop",
+        'ShipService': "RateShop w/SmartPost- RS01",
+        'ShipToAddress1': row['Shipping Address1'],
+        'ShipToAddress2': row['Shipping Address2'],
+        'ShipToEmail': row['Email'],
+        'ShipTo Name': row['Shipping Name'],
+        'ShipToCity': row['Shipping City'],
+        'ShipToState': row['Shipping Province'],
+        'ShipToZip': clean_zip_text(row['Shipping Zip']),
+        'ShipToCountry': row['Shipping Country'],
+        'ShipToPhone': clean_phone_text(row['Shipping Phone']),
+        'SKU': row[ROUTED_SKU],
+        'Quantity': row['Lineitem quantity'],
+        }
+    # same as pd.concat, anything the template doesn't have goes on the end
+    return [values.get(col) or '' for col in columns] + [value or '' for col, value in values.items() if col not in columns]
+
+def shop2verde(shop_pd,verde_pd, only_sku_of, outfile, order_index=None, checks=None, profiler=NULL_PROFILER):
+    if checks is None:
+        checks = OrderChecks(VERDE_CHECKS, "VERDE")
+    with profiler.stage("paid filter", len(shop_pd)) as stage:
+        paid_pd = paid_line_items(shop_pd)
+        stage.rows_out = len(paid_pd)
+    with profiler.cprofile():
+        verde_pd = build_verde(paid_pd, verde_pd, only_sku_of, checks, order_index, profiler)
+    with profiler.stage("write", len(verde_pd)):
+        verde_pd.to_csv(outfile,index=False,header=None,sep='\t')
+    if order_index is not None:
+        # only once the output is written, so a failed run sends the same orders next time
+        with profiler.stage("order index commit"):
+            order_index.commit(outfile)
+    with profiler.stage("checks report"):
+        checks.finish()
+
+def shop2verde_rows(shop_rows, columns, only_sku_of, outfile, order_index=None, checks=None):
+    # shop2verde() of a small export read by read_shopify_rows(), without ever importing pandas
+    if checks is None:
+        checks = OrderChecks(VERDE_CHECKS, "VERDE")
+    verde_rows = build_verde_rows(paid_rows(shop_rows), columns, only_sku_of, checks, order_index)
+    # the same dialect as to_csv(sep='\t')
+    with open(outfile, 'w', newline='') as out:
+        csv.writer(out, delimiter='\t', lineterminator=os.linesep).writerows(verde_rows)
+    if order_index is not None:
+        order_index.commit(outfile)
+    checks.finish()
 
-    verde_pd.to_csv(outfile,index=False,header=None,sep='\t')
+def shop2verde_stream(shopify_fnames, verde_pd, only_sku_of, outfile, chunksize=STREAM_CHUNKSIZE, order_index=None, checks=None, profiler=NULL_PROFILER, use_cache=True):
+    # convert the shopify exports a chunk of whole orders at a time, writing each chunk straight to the TSV
+    # so memory stays bounded by the chunk size instead of the export size.
+    if checks is None:
+        checks = OrderChecks(VERDE_CHECKS, "VERDE")
+    with open(outfile, 'w', newline='') as out:
+        for paid_pd in profiler.iterate("read shopify + paid filter", read_shopify_files_chunks(shopify_fnames, chunksize, use_cache)):
+            with profiler.cprofile():
+                chunk_pd = build_verde(paid_pd, verde_pd, only_sku_of, checks, order_index, profiler)
+            with profiler.stage("write", len(chunk_pd)):
+                chunk_pd.to_csv(out,index=False,header=None,sep='\t')
+            verde_pd = verde_pd.iloc[0:0] # only write the template's own rows once
+    if order_index is not None:
+        with profiler.stage("order index commit"):
+            order_index.commit(outfile)
+    with profiler.stage("checks report"):
+        checks.finish()
 
 if __name__ == "__main__":
     # take in commandline arguments
     argv = sys.argv[1:]
     try:
-        opts, args = getopt.getopt(argv,"hv:s:o:",["--verde=","--shopify=","--only="])
+        opts, args = getopt.getopt(argv,"hv:s:o:",["verde=","shopify=","only=","stream","chunksize=","index=","no-index","rebuild-index","report=","quarantine=","workers=","no-cache","fast-rows=","profile","profile-dump="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
 
     #run through each arg from commandline
-    verde_fname, shopify_fname, only_sku_of= process_args(opts, args)
+    verde_fname, shopify_fnames, only_sku_of, stream, chunksize, index_fname, use_index, rebuild_index, report_fname, quarantine_fname, workers, profile, profile_dump_fname, use_cache, fast_rows = process_args(opts, args)
 
     # generate pd from verde and shopify data
-    if (shopify_fname is None):
+    if not shopify_fnames:
         print_help()
         print("--shopify= option is missing")
         sys.exit(2)
-    if (verde_fname is None):
-        #download verde .xlsx if no -v argument
-        verde_xlsx_fname = "verde_template.xlsx"
-        download_verde_template(verde_xlsx_fname)
-        verde_pd = pd.read_excel(open(verde_xlsx_fname, 'rb'), header=1)  
-    else:
-        # just use the -v argument for the template file.
-        verde_pd = pd.read_excel(open(verde_fname,'rb'), header=1)
-    shop_pd = pd.read_csv(shopify_fname)
+    profiler = StageProfiler(profile, profile_dump_fname) if profile else NULL_PROFILER
+    # a small export is read before anything else, to see whether pandas is needed at all
+    shop_rows = None
+    if fast_rows > 0 and len(shopify_fnames) == 1 and not stream and quarantine_fname is None and not profile:
+        shop_rows = read_shopify_rows(shopify_fnames[0], fast_rows)
+    columns = verde_template_columns(verde_fname) if shop_rows is not None else None
+    if columns is None:
+        with profiler.stage("template"):
+            verde_pd = load_verde_template(verde_fname)
+    checks = OrderChecks(VERDE_CHECKS, "VERDE", report_fname, quarantine_fname)
+    order_index = open_order_index(index_fname, use_index, ["verde"] if rebuild_index else [])
         
     # convert shopify to verde
     timestamp = time.strftime('%m-%d_%H%M%S', time.localtime())
     #TODO add a cmdline option for output file
-    shop2verde(shop_pd=shop_pd,verde_pd=verde_pd, only_sku_of=only_sku_of, outfile="verde_"+timestamp+".txt")
+    outfile = "verde_"+timestamp+".txt"
+    if columns is not None:
+        shop2verde_rows(shop_rows, columns, only_sku_of, outfile, order_index, checks)
+    elif stream:
+        shop2verde_stream(shopify_fnames=shopify_fnames, verde_pd=verde_pd, only_sku_of=only_sku_of, outfile=outfile, chunksize=chunksize, order_index=order_index, checks=checks, profiler=profiler, use_cache=use_cache)
+    else:
+        with profiler.stage("read shopify") as stage:
+            shop_pd = read_shopify_files(shopify_fnames, workers, use_cache)
+            stage.rows_out = len(shop_pd)
+        shop2verde(shop_pd=shop_pd,verde_pd=verde_pd, only_sku_of=only_sku_of, outfile=outfile, order_index=order_index, checks=checks, profiler=profiler)
+    profiler.finish(profile_trace_fname(outfile))
     #TODO refactor this to be JD and VERDE orthogonally as options.
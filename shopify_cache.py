@@ -0,0 +1,73 @@
+import hashlib
+import os
+from template_cache import CACHE_DIR, file_sha256
+
+# parsed shopify exports, so converting the same export again (another -o mode, the other 3PL) skips read_csv
+SHOPIFY_CACHE_DIR = os.path.join(CACHE_DIR, "shopify")
+# once the snapshots add up to more than this, the least recently used ones are deleted
+SHOPIFY_CACHE_MAX_BYTES = 2 * 2**30
+SNAPSHOT_EXT = ".feather"
+
+def feather_module():
+    # pyarrow is optional, without it there's just no cache
+    try:
+        from pyarrow import feather
+    except ImportError:
+        return None
+    return feather
+
+def snapshot_fname(shopify_fname, loader_key):
+    # keyed on what's in the export, not its name or date, plus loader_key: whatever changes what the parsed
+    # frame looks like (columns, dtypes, pandas version). None if there's no pyarrow.
+    if feather_module() is None:
+        return None
+    key = hashlib.sha256((file_sha256(shopify_fname) + "|" + loader_key).encode()).hexdigest()
+    return os.path.join(SHOPIFY_CACHE_DIR, key + SNAPSHOT_EXT)
+
+def load_snapshot(cache_fname):
+    # the snapshot as a memory mapped arrow table, None if it's not in the cache
+    if cache_fname is None or not os.path.isfile(cache_fname):
+        return None
+    try:
+        table = feather_module().read_table(cache_fname, memory_map=True)
+    except Exception as e:
+        # a broken snapshot is just a miss, the export is parsed and cached again
+        print("WARNING: ignoring unreadable shopify cache file " + cache_fname + ": " + str(e))
+        return None
+    # last used now, for evict()
+    os.utime(cache_fname)
+    return table
+
+def save_snapshot(cache_fname, shop_pd, max_bytes=SHOPIFY_CACHE_MAX_BYTES):
+    if cache_fname is None:
+        return
+    os.makedirs(SHOPIFY_CACHE_DIR, exist_ok=True)
+    # uncompressed, so it can be memory mapped. write then rename, same as the template cache
+    tmp_fname = cache_fname + ".tmp%d" % os.getpid()
+    feather_module().write_feather(shop_pd, tmp_fname, compression='uncompressed')
+    os.replace(tmp_fname, cache_fname)
+    evict(max_bytes, keep=cache_fname)
+
+def evict(max_bytes=SHOPIFY_CACHE_MAX_BYTES, keep=None):
+    # delete the least recently used snapshots until the rest fit in max_bytes. keep is never deleted, even if
+    # it's bigger than max_bytes on its own.
+    snapshots = []
+    for fname in os.listdir(SHOPIFY_CACHE_DIR):
+        if fname.endswith(SNAPSHOT_EXT):
+            path = os.path.join(SHOPIFY_CACHE_DIR, fname)
+            try:
+                stat = os.stat(path)
+            except OSError: # evicted by another run in the mean time
+                continue
+            snapshots.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in snapshots)
+    for _, size, path in sorted(snapshots):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError: # still open in another run (windows), or already gone
+            pass
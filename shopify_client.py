@@ -0,0 +1,72 @@
+import json
+import os
+import socket
+import sys,getopt
+
+# where shopify_daemon.py takes jobs. only from this machine
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 47630
+
+def print_help():
+    help_str=' python shopify_client.py -s FNAME_SHOPIFY [-s FNAME_SHOPIFY ...] [--verde-only=MODES] [--jd-only=MODES] [--port=N] \n\
+     python shopify_client.py --stop [--port=N] \n\
+            Hands shopify exports to the shopify_daemon.py running on this machine and prints what it printed while converting them. Only imports the standard library, so it starts in no time.\n\
+            -s FNAME_SHOPIFY  (--shopify=FNAME_SHOPIFY) the export(s) to convert into one set of outputs. Same as in the converters: can be given more than once, as a comma separated list or a glob\n\
+            --verde-only=MODES and --jd-only=MODES  the outputs to write for this job, instead of the ones the daemon was started with\n\
+            --port=N  the port the daemon was started with (default %d)\n\
+            --stop  stops the daemon\n\n\
+            Exit code 1 if the conversion failed, 2 if there is no daemon.' % DAEMON_PORT
+    print(help_str)
+
+def process_args(opts, args):
+    shopify_fnames = []
+    verde_modes = None
+    jd_modes = None
+    port = DAEMON_PORT
+    stop = False
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt in ("-s", "--shopify"):
+            # absolute, as the daemon may be running somewhere else. the globs are expanded by the daemon
+            shopify_fnames.extend(os.path.abspath(fname.strip()) for fname in arg.split(",") if fname.strip())
+        elif opt == "--verde-only":
+            verde_modes = [mode.strip() for mode in arg.split(",") if mode.strip()]
+        elif opt == "--jd-only":
+            jd_modes = [mode.strip() for mode in arg.split(",") if mode.strip()]
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--stop":
+            stop = True
+    return (shopify_fnames, verde_modes, jd_modes, port, stop)
+
+def send_job(job, port=DAEMON_PORT):
+    # hand a job to the daemon and wait for its result, see ConversionDaemon.submit() in shopify_daemon.py
+    with socket.create_connection((DAEMON_HOST, port)) as sock:
+        sock.sendall((json.dumps(job) + "\n").encode())
+        reply = sock.makefile(encoding='utf-8').readline()
+    return json.loads(reply)
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"hs:",["shopify=","verde-only=","jd-only=","port=","stop"])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+    shopify_fnames, verde_modes, jd_modes, port, stop = process_args(opts, args)
+    if not shopify_fnames and not stop:
+        print_help()
+        print("--shopify= option is missing")
+        sys.exit(2)
+
+    job = {'stop': True} if stop else {'shopify': shopify_fnames, 'verde_only': verde_modes, 'jd_only': jd_modes}
+    try:
+        result = send_job(job, port)
+    except ConnectionError:
+        print("no shopify_daemon.py is running on port " + str(port))
+        sys.exit(2)
+    if stop:
+        print("stopped the daemon on port " + str(port))
+    print(result.get('log', ""), end="")
+    sys.exit(1 if 'error' in result else 0)
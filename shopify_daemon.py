@@ -0,0 +1,305 @@
+import json
+import os
+import queue
+import socketserver
+import sys,getopt
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout
+import shopify2verde
+import shopify2jd
+from shopify2all import shop2all, all_checks, parse_modes, sku_modes
+from shopify_loader import read_shopify_files, expand_shopify_fnames
+from order_index import open_order_index, ORDER_INDEX_FNAME
+from shopify_client import DAEMON_HOST, DAEMON_PORT
+
+# how often the drop folder is looked at
+POLL_SECONDS = 2.0
+# where converted (and unconvertible) exports are moved to, inside the drop folder
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+
+def print_help():
+    help_str=' python shopify_daemon.py [-v FNAME_VERDE] [-j FNAME_JD] [--verde-only=MODES] [--jd-only=MODES] [--watch=DIR] [--out=DIR] [--port=N] [--poll=SECONDS] [--index=FNAME_INDEX | --no-index] [--report] [--quarantine] [--no-cache] \n\
+            Keeps the templates, SKU routes and SKU weights loaded and the order index open, and converts every shopify export it is given straight away, instead of paying for the imports and the template parse on every run like shopify2verde.py / shopify2jd.py / shopify2all.py do. Restart it after changing a template, sku_routes.csv or sku_weights.csv.\n\
+            -v FNAME_VERDE, -j FNAME_JD, --verde-only=MODES and --jd-only=MODES  same as in shopify2all.py: the outputs written for every export (e.g. --verde-only=all --jd-only=mats writes verde_all_TIMESTAMP.txt and jd_mats_TIMESTAMP.xlsx)\n\
+            --watch=DIR  converts every .csv dropped in DIR once it is done being copied, then moves it to DIR/%s/ (or DIR/%s/ if it could not be converted) with the timestamp of its outputs added to its name, e.g. orders_export_10-18_091743.csv\n\
+            --out=DIR  where the outputs go (default: the current directory)\n\
+            --port=N  the local port it takes jobs from shopify_client.py on (default %d)\n\
+            --poll=SECONDS  how often to look in the --watch folder (default %s)\n\
+            --index=FNAME_INDEX and --no-index  same as in the converters (default %s)\n\
+            --report and --quarantine  write report_TIMESTAMP.csv / quarantine_TIMESTAMP.csv next to each job\'s outputs, see the converters\' --report= and --quarantine=\n\
+            --no-cache  same as in the converters\n\n\
+            For example, python shopify_client.py -s orders_export.csv converts orders_export.csv with the running daemon, and python shopify_client.py --stop stops it' % (DONE_DIR, FAILED_DIR, DAEMON_PORT, POLL_SECONDS, ORDER_INDEX_FNAME)
+    print(help_str)
+
+def process_args(opts, args):
+    verde_fname = None
+    jd_fname = None
+    verde_modes = None
+    jd_modes = None
+    watch_dir = None
+    out_dir = ""
+    port = DAEMON_PORT
+    poll = POLL_SECONDS
+    index_fname = ORDER_INDEX_FNAME
+    use_index = True
+    report = False
+    quarantine = False
+    use_cache = True
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt in ("-v", "--verde"):
+            verde_fname = arg
+        elif opt in ("-j", "--jd"):
+            jd_fname = arg
+        elif opt == "--verde-only":
+            verde_modes = parse_modes(arg)
+        elif opt == "--jd-only":
+            jd_modes = parse_modes(arg)
+        elif opt == "--watch":
+            watch_dir = arg
+        elif opt == "--out":
+            out_dir = arg
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--poll":
+            poll = float(arg)
+        elif opt == "--index":
+            index_fname = arg
+        elif opt == "--no-index":
+            use_index = False
+        elif opt == "--report":
+            report = True
+        elif opt == "--quarantine":
+            quarantine = True
+        elif opt == "--no-cache":
+            use_cache = False
+    return (verde_fname, jd_fname, verde_modes, jd_modes, watch_dir, out_dir, port, poll, index_fname, use_index, report, quarantine, use_cache)
+
+class JobLog:
+    # what a job prints goes to the daemon's stdout as usual, and is kept to send back to whoever asked for the job
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+class ConversionDaemon:
+    # the warm state every job is converted with. jobs come in from the drop folder and the socket, and are run one
+    # at a time in the order they came in by run(), so they never step on each other's outputs or order index rows.
+    def __init__(self, verde_pd, jd_pd, jd_merged_headers, verde_modes, jd_modes, out_dir="", order_index=None, report=False, quarantine=False, use_cache=True):
+        self.verde_pd = verde_pd
+        self.jd_pd = jd_pd
+        self.jd_merged_headers = jd_merged_headers
+        self.verde_modes = verde_modes
+        self.jd_modes = jd_modes
+        self.out_dir = out_dir
+        self.order_index = order_index
+        self.report = report
+        self.quarantine = quarantine
+        self.use_cache = use_cache
+        self.sku_weights = shopify2jd.load_sku_weights() if jd_pd is not None else None
+        self.jobs = queue.Queue()
+        self.last_timestamp = None
+        self.same_second = 0
+
+    def submit(self, job):
+        # queue a job and wait for it to be converted. job is {'shopify': [fnames or globs], 'verde_only': [modes],
+        # 'jd_only': [modes]}, the modes are optional. returns {'outfiles': [fnames], 'timestamp': the one in their names,
+        # 'log': what was printed} or {'error': ..., 'timestamp': ..., 'log': ...}
+        reply = queue.Queue()
+        self.jobs.put((job, reply))
+        return reply.get()
+
+    def stop(self):
+        self.jobs.put((None, None))
+
+    def next_timestamp(self):
+        # same names as the converters' outputs. a second job in the same second gets _2 on the end, and so on
+        timestamp = time.strftime('%m-%d_%H%M%S', time.localtime())
+        if timestamp == self.last_timestamp:
+            self.same_second += 1
+            return timestamp + "_" + str(self.same_second)
+        self.last_timestamp = timestamp
+        self.same_second = 1
+        return timestamp
+
+    def convert(self, job, timestamp):
+        check_job(job)
+        print("converting " + ", ".join(job['shopify']))
+        verde_modes = self.verde_modes if job.get('verde_only') is None else job['verde_only']
+        jd_modes = self.jd_modes if job.get('jd_only') is None else job['jd_only']
+        for mode in verde_modes + jd_modes:
+            if mode not in sku_modes:
+                raise ValueError("Unknown SKU mode \"" + mode + "\". Has to be one of: " + ", ".join(sku_modes))
+        if not verde_modes and not jd_modes:
+            raise ValueError("nothing to do, no --verde-only= or --jd-only= modes")
+        if verde_modes and self.verde_pd is None:
+            raise ValueError("the daemon was started without a verde template, restart it with -v")
+        if jd_modes and self.jd_pd is None:
+            raise ValueError("the daemon was started without a JD template, restart it with -j")
+        shopify_fnames = expand_shopify_fnames(job['shopify'])
+        if not shopify_fnames:
+            raise ValueError("no shopify exports to convert")
+        # every order index lookup reads the index itself, so it sees whatever shopify2verde.py and friends sent since
+        shop_pd = read_shopify_files(shopify_fnames, use_cache=self.use_cache)
+        report_fname = os.path.join(self.out_dir, "report_" + timestamp + ".csv") if self.report else None
+        quarantine_fname = os.path.join(self.out_dir, "quarantine_" + timestamp + ".csv") if self.quarantine else None
+        checks = all_checks(verde_modes, jd_modes, report_fname, quarantine_fname)
+        try:
+            return shop2all(shop_pd, self.verde_pd, self.jd_pd, self.jd_merged_headers, verde_modes, jd_modes, timestamp, order_index=self.order_index,
+                    checks=checks, sku_weights=self.sku_weights, out_dir=self.out_dir)
+        except Exception:
+            if self.order_index is not None:
+                # nothing of this job was written, so none of it is recorded as sent
+                self.order_index.discard()
+            raise
+
+    def run(self):
+        # convert jobs until stop()
+        while True:
+            job, reply = self.jobs.get()
+            if job is None:
+                return
+            log = JobLog(sys.stdout)
+            timestamp = self.next_timestamp()
+            with redirect_stdout(log):
+                try:
+                    outfiles = self.convert(job, timestamp)
+                    for outfile in outfiles:
+                        print("wrote " + outfile)
+                    result = {'outfiles': outfiles, 'timestamp': timestamp}
+                except Exception as e:
+                    traceback.print_exc(file=sys.stdout)
+                    result = {'error': str(e), 'timestamp': timestamp}
+            result['log'] = log.getvalue()
+            reply.put(result)
+
+def check_job(job):
+    # whatever comes in over the socket, so a job that isn't shaped like submit() says is an error result for the
+    # client rather than a crash that takes the daemon down with it
+    if not isinstance(job, dict):
+        raise ValueError("a job has to be a json object, not " + json.dumps(job))
+    if not isinstance(job.get('shopify'), list) or not job['shopify'] or not all(isinstance(fname, str) for fname in job['shopify']):
+        raise ValueError("a job needs 'shopify': a list of the shopify exports to convert")
+    for key in ('verde_only', 'jd_only'):
+        if job.get(key) is not None and (not isinstance(job[key], list) or not all(isinstance(mode, str) for mode in job[key])):
+            raise ValueError("'" + key + "' has to be a list of SKU modes")
+
+def moved_fname(watch_dir, path, result):
+    # where a converted export goes: done/ or failed/, with the job's timestamp (the one in its outputs' names) on
+    # the end, as every shopify export is called orders_export.csv and the one before it must not be overwritten
+    root, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(watch_dir, FAILED_DIR if 'error' in result else DONE_DIR, root + "_" + result['timestamp'] + ext)
+
+def watch_folder(daemon, watch_dir, poll=POLL_SECONDS):
+    # a .csv dropped in watch_dir is converted once its size and mtime are the same two polls in a row, so a file
+    # that's still being copied in is left alone until it's all there. oldest first.
+    # nothing that goes wrong in here stops the watching: it's printed and looked at again next poll. an export that
+    # was converted but can't be moved out of the way is not converted again until it changes.
+    last_seen = {}
+    stuck = {}
+    while True:
+        try:
+            seen = {}
+            for entry in os.scandir(watch_dir):
+                if entry.is_file() and entry.name.lower().endswith(".csv") and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    seen[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            for path in sorted(seen, key=seen.get):
+                if last_seen.get(path) != seen[path] or stuck.get(path) == seen[path]:
+                    continue
+                result = daemon.submit({'shopify': [path]})
+                # out of the way, so it's not converted again
+                moved = moved_fname(watch_dir, path, result)
+                try:
+                    os.makedirs(os.path.dirname(moved), exist_ok=True)
+                    os.replace(path, moved)
+                except OSError:
+                    stuck[path] = seen[path]
+                    raise
+            last_seen = seen
+        except Exception:
+            print("watching " + watch_dir + " failed, trying again in " + str(poll) + "s:")
+            traceback.print_exc(file=sys.stdout)
+        time.sleep(poll)
+
+class JobHandler(socketserver.StreamRequestHandler):
+    # one json job per line in, one json result per line back
+    def handle(self):
+        for line in self.rfile:
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                result = {'error': "not a json job: " + str(e)}
+            else:
+                if isinstance(job, dict) and job.get('stop'):
+                    self.server.converter.stop()
+                    result = {'stopped': True}
+                else:
+                    result = self.server.converter.submit(job)
+            self.wfile.write((json.dumps(result) + "\n").encode())
+
+class JobServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if __name__ == "__main__":
+    # take in commandline arguments
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"hv:j:",["verde=","jd=","verde-only=","jd-only=","watch=","out=","port=","poll=","index=","no-index","report","quarantine","no-cache"])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    #run through each arg from commandline
+    verde_fname, jd_fname, verde_modes, jd_modes, watch_dir, out_dir, port, poll, index_fname, use_index, report, quarantine, use_cache = process_args(opts, args)
+
+    verde_modes = verde_modes or []
+    jd_modes = jd_modes or []
+    if not verde_modes and not jd_modes:
+        print_help()
+        print("nothing to do, please pass --verde-only= and/or --jd-only=")
+        sys.exit(2)
+    if jd_modes and jd_fname is None:
+        print ("-j argument (--jd=) argument is missing. Please use -j to specify which .xlsx is the JD template file")
+        sys.exit(2)
+    if watch_dir is not None and not os.path.isdir(watch_dir):
+        print("--watch folder " + watch_dir + " doesn't exist")
+        sys.exit(2)
+
+    # everything every job needs, loaded once
+    verde_pd = shopify2verde.load_verde_template(verde_fname) if verde_modes or verde_fname else None
+    jd_pd = shopify2jd.load_jd_template(jd_fname) if jd_fname else None
+    jd_merged_headers = shopify2jd.load_jd_merged_headers(jd_fname) if jd_fname else None
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    daemon = ConversionDaemon(verde_pd, jd_pd, jd_merged_headers, verde_modes, jd_modes, out_dir, open_order_index(index_fname, use_index), report, quarantine, use_cache)
+
+    try:
+        server = JobServer((DAEMON_HOST, port), JobHandler)
+    except OSError as e:
+        print("can't listen on port " + str(port) + " (is another shopify_daemon.py running?): " + str(e))
+        sys.exit(2)
+    server.converter = daemon
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if watch_dir is not None:
+        threading.Thread(target=watch_folder, args=(daemon, watch_dir, poll), daemon=True).start()
+    print("listening on " + DAEMON_HOST + ":" + str(port) + ("" if watch_dir is None else ", watching " + watch_dir) + ". Ctrl-C or python shopify_client.py --stop to quit")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
@@ -0,0 +1,200 @@
+import csv
+import glob
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from shopify_cache import snapshot_fname, load_snapshot, save_snapshot
+from shopify_orders import fill_order_fields, group_orders, ORDER_COLUMNS
+
+# how many shopify rows to read at a time in --stream mode
+STREAM_CHUNKSIZE = 50000
+# the only columns of the export (70 odd of them) that any converter uses. the rest are never parsed
+SHOPIFY_COLUMNS = ['Name', 'Email', 'Financial Status', 'Lineitem quantity', 'Lineitem sku', 'Shipping Name',
+        'Shipping Address1', 'Shipping Address2', 'Shipping City', 'Shipping Zip', 'Shipping Province',
+        'Shipping Country', 'Shipping Phone', 'Risk Level']
+# free text columns are always read as text. otherwise pandas guesses their dtype per export/chunk, and a chunk where
+# every Shipping Address2 happens to be a number comes out as floats, and zips come out as ints (07731 -> 7731)
+SHOPIFY_TEXT_COLUMNS = ['Name', 'Email', 'Shipping Name', 'Shipping Address1', 'Shipping Address2', 'Shipping City',
+        'Shipping Zip', 'Shipping Phone']
+# a handful of values repeated down every row, stored once each
+SHOPIFY_CATEGORY_COLUMNS = ['Financial Status', 'Risk Level', 'Lineitem sku', 'Shipping Province', 'Shipping Country']
+SHOPIFY_DTYPES = dict([(col, str) for col in SHOPIFY_TEXT_COLUMNS] + [(col, 'category') for col in SHOPIFY_CATEGORY_COLUMNS])
+# what pd.read_csv reads as NaN, for read_shopify_rows(). "None" is only NaN since pandas 2, so an export with one in
+# it is left to pandas
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+        'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'}
+PANDAS_ONLY_NA_VALUES = {'None'}
+# a quantity read_csv reads as a plain int64
+QUANTITY_PATTERN = re.compile(r'[0-9]{1,18}')
+
+def as_text(values):
+    # a column (or frame) of the export as strings, '' where it's blank. fillna first, as pandas' str dtype keeps
+    # NaNs through astype(str), and as objects, as a category column can't be filled with a value that isn't one
+    # of its categories
+    return values.astype(object).fillna('').astype(str)
+
+def snapshot_key():
+    # a cached export parsed with other columns/dtypes, other order fields filled in, or by another pandas, is never used
+    import pandas as pd
+    return repr((SHOPIFY_COLUMNS, sorted((col, str(dtype)) for col, dtype in SHOPIFY_DTYPES.items()), ORDER_COLUMNS, pd.__version__))
+
+def read_shopify_csv(shopify_fname, **kwargs):
+    # pd.read_csv() of just the columns we use, with the dtypes above. kwargs go to read_csv (chunksize...)
+    import pandas as pd
+    return pd.read_csv(shopify_fname, usecols=lambda col: col in SHOPIFY_COLUMNS, dtype=SHOPIFY_DTYPES, **kwargs)
+
+def read_shopify_export(shopify_fname, use_cache=True):
+    # read_shopify_csv() of one export with every line item's order fields filled in (see shopify_orders.py), from
+    # its snapshot in .3pl_cache/shopify if this exact file was read before
+    cache_fname = snapshot_fname(shopify_fname, snapshot_key()) if use_cache else None
+    table = load_snapshot(cache_fname)
+    if table is not None:
+        return table.to_pandas()
+    shop_pd = fill_order_fields(read_shopify_csv(shopify_fname))
+    save_snapshot(cache_fname, shop_pd)
+    return shop_pd
+
+def read_shopify_rows(shopify_fname, max_rows):
+    # read_shopify_csv() of a small export with just the csv module, for the converters' no-pandas path. a list of
+    # {column: value} dicts with the values read_csv would read, as text: None where it reads a NaN, and the
+    # quantities the way their ints are printed ("02" -> "2"). None if the export has more than max_rows rows, or anything
+    # read_csv might not read the same way (a missing or repeated column, a row with too many or too few fields, a
+    # quantity that isn't a plain number), for the caller to use pandas instead. order fields are filled in like
+    # read_shopify_export() does.
+    try:
+        with open(shopify_fname, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None or any(header.count(col) != 1 for col in SHOPIFY_COLUMNS):
+                return None
+            positions = [(col, header.index(col)) for col in SHOPIFY_COLUMNS]
+            rows = []
+            for fields in reader:
+                if not fields: # blank line, read_csv skips those too
+                    continue
+                if len(fields) != len(header) or len(rows) == max_rows:
+                    return None
+                row = {}
+                for col, pos in positions:
+                    value = fields[pos]
+                    if value in PANDAS_ONLY_NA_VALUES:
+                        return None
+                    row[col] = None if value in NA_VALUES else value
+                quantity = row['Lineitem quantity']
+                if quantity is None or not QUANTITY_PATTERN.fullmatch(quantity):
+                    return None
+                row['Lineitem quantity'] = str(int(quantity))
+                rows.append(row)
+    except (UnicodeDecodeError, csv.Error):
+        return None
+    return [row for order in group_orders(rows) for row in order.rows()]
+
+def snapshot_chunks(table, chunksize):
+    # read_shopify_csv(chunksize=...) of a cached export. only one chunk at a time is copied out of the memory map,
+    # numbered on from the last one like read_csv's chunks
+    import pandas as pd
+    for start in range(0, table.num_rows, chunksize):
+        chunk = table.slice(start, chunksize).to_pandas()
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        yield chunk
+
+def with_categories(shop_pd):
+    # pd.concat() of frames whose categories differ falls back to plain objects, this puts the categories back
+    return shop_pd.astype({col: 'category' for col in SHOPIFY_CATEGORY_COLUMNS if col in shop_pd.columns})
+
+def read_shopify_chunks(shopify_fname, chunksize=STREAM_CHUNKSIZE, use_cache=True):
+    # yield the shopify export a chunk at a time without ever splitting an order across two chunks, with the order
+    # fields filled in. shopify writes all line items of an order on consecutive rows, so the rows of the last order
+    # in each chunk are held back and put in front of the next chunk instead.
+    # an export that's in the cache is read from there, but one that isn't is not added to it, as that would
+    # take the whole export in memory.
+    import pandas as pd
+    import numpy as np
+    table = load_snapshot(snapshot_fname(shopify_fname, snapshot_key())) if use_cache else None
+    chunks = read_shopify_csv(shopify_fname, chunksize=chunksize) if table is None else snapshot_chunks(table, chunksize)
+    carry = None
+    for chunk in chunks:
+        if carry is not None and len(carry):
+            chunk = with_categories(pd.concat([carry, chunk]))
+        # find where the run of rows for the last order starts
+        other_orders = np.flatnonzero((chunk['Name'] != chunk['Name'].iloc[-1]).to_numpy())
+        tail_start = other_orders[-1]+1 if len(other_orders) else 0
+        carry = chunk.iloc[tail_start:]
+        if tail_start > 0:
+            yield fill_order_fields(chunk.iloc[:tail_start])
+    if carry is not None and len(carry):
+        yield fill_order_fields(carry)
+
+def paid_line_items(shop_pd):
+    # not paid yet / cancelled / refunded, so we're not gonna order anything for them.
+    return shop_pd[shop_pd['Financial Status']=="paid"]
+
+def paid_rows(rows):
+    # paid_line_items() of read_shopify_rows()
+    return [row for row in rows if row['Financial Status'] == "paid"]
+
+def expand_shopify_fnames(args, what="shopify exports"):
+    # -s can be given more than once, and each one can be a comma separated list and/or a glob like "orders_*.csv".
+    # globs are expanded in sorted order, and a file named twice is only read once. what is what the files are, for
+    # the warning (order_submit.py expands its outputs with this too)
+    fnames = []
+    for arg in args:
+        for pattern in arg.split(","):
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matches:
+                print("WARNING: no " + what + " match " + pattern)
+            fnames.extend(fname for fname in matches if fname not in fnames)
+    return fnames
+
+def line_item_hashes(shop_pd):
+    # one 64 bit hash per line item of Name + Lineitem sku, plus which line of the order with that SKU it is, so an
+    # order with the same SKU on two lines keeps both of them. as text, as groupby would leave NaNs out
+    import pandas as pd
+    keys = as_text(shop_pd[['Name', 'Lineitem sku']])
+    keys['line'] = keys.groupby(['Name', 'Lineitem sku'], sort=False).cumcount()
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def read_paid_line_items(shopify_fname, use_cache=True):
+    # what each worker process does for one export: parse it, keep the paid rows and hash them for the merge
+    paid_pd = paid_line_items(read_shopify_export(shopify_fname, use_cache))
+    return paid_pd, line_item_hashes(paid_pd)
+
+def read_shopify_files(shopify_fnames, workers=None, use_cache=True):
+    # read any number of (overlapping) shopify exports as one. a single export is read as is. several are parsed
+    # at the same time in a process pool and merged in the order they were given, keeping the first copy of each
+    # line item that is in more than one of them.
+    import pandas as pd
+    import numpy as np
+    if len(shopify_fnames) == 1:
+        return read_shopify_export(shopify_fnames[0], use_cache)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parsed = list(pool.map(partial(read_paid_line_items, use_cache=use_cache), shopify_fnames))
+    merged = pd.concat([paid_pd for paid_pd, hashes in parsed], ignore_index=True)
+    duplicate = pd.Series(np.concatenate([hashes for paid_pd, hashes in parsed])).duplicated().to_numpy()
+    if duplicate.any():
+        print("Dropping " + str(int(duplicate.sum())) + " line items that are in more than one of the shopify exports")
+    return with_categories(merged[~duplicate].reset_index(drop=True))
+
+def read_shopify_files_chunks(shopify_fnames, chunksize=STREAM_CHUNKSIZE, use_cache=True):
+    # --stream version of read_shopify_files(): the exports are read one after the other a chunk at a time, and
+    # only a sorted array of the hashes from the exports before this one is kept around for the de-duplication.
+    # (a line item can't be in an export twice, as an order's rows are never split across chunks.)
+    import numpy as np
+    seen = np.empty(0, dtype=np.uint64)
+    dropped = 0
+    for shopify_fname in shopify_fnames:
+        file_hashes = []
+        for shop_pd in read_shopify_chunks(shopify_fname, chunksize, use_cache):
+            paid_pd = paid_line_items(shop_pd)
+            hashes = line_item_hashes(paid_pd)
+            pos = np.minimum(np.searchsorted(seen, hashes), max(len(seen) - 1, 0))
+            duplicate = seen[pos] == hashes if len(seen) else np.zeros(len(hashes), dtype=bool)
+            file_hashes.append(hashes)
+            dropped += int(duplicate.sum())
+            yield paid_pd[~duplicate]
+        seen = np.union1d(seen, np.concatenate(file_hashes)) if file_hashes else seen
+    if dropped:
+        print("Dropped " + str(dropped) + " line items that are in more than one of the shopify exports")
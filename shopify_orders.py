@@ -0,0 +1,94 @@
+# shopify writes one row per line item, but only fills the order's own fields (shipping, financial status, risk...)
+# on the first row of each order. an order here is a run of consecutive rows with the same Name, which is how
+# shopify writes them (read_shopify_chunks() relies on that too).
+# shopify_loader.py fills the order fields in as it reads an export, and everything after that works on the filled
+# line items: the builders never iterate orders. JD weighs an order with a groupby on its number (see
+# build_service_product_info()), as the rows of an order are only consecutive within one export.
+
+# the fields that belong to the order, not the line item. a line item without one gets its order's
+ORDER_COLUMNS = ['Email', 'Financial Status', 'Shipping Name', 'Shipping Address1', 'Shipping Address2', 'Shipping City',
+        'Shipping Zip', 'Shipping Province', 'Shipping Country', 'Shipping Phone', 'Risk Level']
+
+class Orders:
+    # the orders of a frame of shopify rows, array-backed: where each order's rows start, and for every order field
+    # which row of the order it comes from, worked out in a single pass over the runs of rows. a field comes from
+    # the first row of the order that has it, so it doesn't matter which of its rows shopify filled in.
+    __slots__ = ('starts', 'run_ids', 'field_rows')
+
+    def __init__(self, shop_pd):
+        import numpy as np
+        names = shop_pd['Name']
+        # NaN != NaN, so rows without a Name are an order each
+        new_order = (names != names.shift()).to_numpy()
+        self.starts = np.flatnonzero(new_order)
+        self.run_ids = np.cumsum(new_order) - 1
+        rows = np.arange(len(shop_pd))
+        self.field_rows = {}
+        for col in ORDER_COLUMNS:
+            if col in shop_pd.columns and len(rows):
+                # the smallest row number of each order that has col, len(rows) if none does. -1 is "none" to take()
+                first = np.minimum.reduceat(np.where(shop_pd[col].notna().to_numpy(), rows, len(rows)), self.starts)
+                self.field_rows[col] = np.where(first < len(rows), first, -1)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line_items(self, shop_pd):
+        # shop_pd (the frame the Orders were made from) with the order fields its line items are missing filled in:
+        # forward within the order, and from the first row that has it for the rows before that. categories stay
+        # categories
+        import pandas as pd
+        import numpy as np
+        rows = np.arange(len(shop_pd))
+        order_starts = self.starts[self.run_ids]
+        filled = {}
+        for col, field_rows in self.field_rows.items():
+            last = np.maximum.accumulate(np.where(shop_pd[col].notna().to_numpy(), rows, -1))
+            take = np.where(last >= order_starts, last, field_rows[self.run_ids])
+            filled[col] = pd.Series(shop_pd[col].array.take(take, allow_fill=True), index=shop_pd.index)
+        return shop_pd.assign(**filled)
+
+def fill_order_fields(shop_pd):
+    if shop_pd.empty:
+        return shop_pd
+    return Orders(shop_pd).line_items(shop_pd)
+
+class Order:
+    # one order of read_shopify_rows(): its Name, its fields (ORDER_COLUMNS, from the first row that has each, None
+    # where none does) and its line items, which are its rows as read
+    __slots__ = ('name', 'fields', 'items')
+
+    def __init__(self, name):
+        self.name = name
+        self.fields = dict.fromkeys(ORDER_COLUMNS)
+        self.items = []
+
+    def add(self, row):
+        for col in ORDER_COLUMNS:
+            if self.fields[col] is None:
+                self.fields[col] = row[col]
+        self.items.append(row)
+
+    def rows(self):
+        # the order's line items with the order fields they are missing filled in, the same way Orders.line_items()
+        # does
+        last = dict(self.fields)
+        rows = []
+        for item in self.items:
+            row = dict(item)
+            for col in ORDER_COLUMNS:
+                if row[col] is None:
+                    row[col] = last[col]
+                else:
+                    last[col] = row[col]
+            rows.append(row)
+        return rows
+
+def group_orders(rows):
+    # the Orders of a list of row dicts, in one pass, same as Orders() does for a frame
+    orders = []
+    for row in rows:
+        if not orders or row['Name'] is None or row['Name'] != orders[-1].name:
+            orders.append(Order(row['Name']))
+        orders[-1].add(row)
+    return orders
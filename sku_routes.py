@@ -0,0 +1,71 @@
+import csv
+import os
+import re
+import fnmatch
+from functools import lru_cache
+
+# which shopify SKUs go out as which 3PL SKUs for each -o/--only mode. see sku_routes.csv for the format.
+SKU_ROUTES_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sku_routes.csv")
+# column route_frame() puts the 3PL SKU in
+ROUTED_SKU = 'Routed sku'
+# in the skus column of sku_routes.csv this means "keep the customer's SKU as is"
+SAME_SKU = '{sku}'
+
+class SkuRouter:
+    # compiled version of sku_routes.csv, which has one rule per row: mode, a shell-style pattern (* matches anything)
+    # and a space separated list of 3PL SKUs, where {sku} is the shopify SKU itself. for each mode the rules are tried
+    # in file order and the first pattern that matches the whole shopify SKU decides its list of 3PL SKUs. a SKU nothing matches is dropped
+    # from that mode, and a mode with no rules at all (like no -o option) keeps every SKU as is.
+    def __init__(self, rules):
+        self.rules = {}
+        for mode, pattern, skus in rules:
+            self.rules.setdefault(mode, []).append((re.compile(fnmatch.translate(pattern)), tuple(skus.split())))
+        # every (shop sku, mode) is only ever worked out once
+        self.route = lru_cache(maxsize=None)(self._route)
+
+    def modes(self):
+        return list(self.rules)
+
+    def routed_skus(self):
+        # every 3PL SKU a rule sends out by name, in file order. the ones {sku} passes on as is depend on the export
+        skus = []
+        for rules in self.rules.values():
+            for pattern, route in rules:
+                skus.extend(sku for sku in route if sku != SAME_SKU and sku not in skus)
+        return skus
+
+    def _route(self, shop_sku, only_sku_of):
+        if only_sku_of not in self.rules:
+            return (shop_sku,) #no SKU filtering needed.
+        if not isinstance(shop_sku, str):
+            return ()
+        for pattern, skus in self.rules[only_sku_of]:
+            if pattern.match(shop_sku):
+                return tuple(shop_sku if sku == SAME_SKU else sku for sku in skus)
+        return ()
+
+    def route_frame(self, rows_pd, only_sku_of, sku_col='Lineitem sku'):
+        # returns rows_pd with one row per 3PL SKU (in ROUTED_SKU), in the original row order. rows routed to nothing
+        # are dropped and rows routed to several SKUs are repeated. each distinct SKU is routed once and the result
+        # is broadcast back to all the rows that have it.
+        import pandas as pd
+        shop_sku = rows_pd[sku_col]
+        if only_sku_of not in self.rules:
+            return rows_pd.assign(**{ROUTED_SKU: shop_sku.astype(object)}) #no SKU filtering needed. (objects, same as below, even if sku_col is a category)
+        routes = {sku: self.route(sku, only_sku_of) for sku in shop_sku.dropna().unique()}
+        # empty routes and SKU-less rows explode into NaNs, which are the rows to drop
+        routed = pd.Series(shop_sku.astype(object).map(routes).to_numpy(), dtype=object).explode().dropna()
+        return rows_pd.iloc[routed.index].assign(**{ROUTED_SKU: routed.to_numpy()})
+
+    def route_rows(self, rows, only_sku_of, sku_col='Lineitem sku'):
+        # route_frame() for a list of row dicts (see read_shopify_rows())
+        return [dict(row, **{ROUTED_SKU: sku}) for row in rows for sku in self.route(row[sku_col], only_sku_of)]
+
+def read_sku_routes(fname):
+    with open(fname, newline='') as f:
+        return [(row['mode'], row['pattern'], row['skus']) for row in csv.DictReader(f) if row['mode']]
+
+@lru_cache(maxsize=None)
+def load_sku_routes(fname=SKU_ROUTES_FNAME):
+    # compiled once per process, no matter how many outputs ask for it
+    return SkuRouter(read_sku_routes(fname))
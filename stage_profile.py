@@ -0,0 +1,136 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+def peak_rss_mb():
+    # high water mark of this process so far. ru_maxrss is in KB on linux and in bytes on macs
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+class Stage:
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+class StageProfiler:
+    # wall time, rows in/out and peak memory of each step of a conversion, for --profile. a stage that runs more
+    # than once (once per chunk with --stream, once per output in shopify2all.py) is added up under its name.
+    def __init__(self, enabled=True, cprofile_fname=None):
+        self.enabled = enabled
+        self.cprofile_fname = cprofile_fname
+        self.cprofiler = cProfile.Profile() if cprofile_fname else None
+        self.cprofile_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def record(self, name, seconds, rows_in, rows_out):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'seconds': 0.0, 'rows_in': None, 'rows_out': None, 'peak_rss_mb': None})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            for key, rows in (('rows_in', rows_in), ('rows_out', rows_out)):
+                if rows is not None:
+                    stage[key] = (stage[key] or 0) + rows
+            stage['peak_rss_mb'] = peak_rss_mb()
+
+    def stage(self, name, rows_in=None):
+        # with profiler.stage("route", len(rows)) as stage: ... stage.rows_out = len(routed)
+        return StageTimer(self, name, rows_in) if self.enabled else NullStageTimer()
+
+    def iterate(self, name, frames):
+        # times every next() of a chunk generator, like --stream's readers, and counts the rows it yields
+        frames = iter(frames)
+        while True:
+            start = time.perf_counter()
+            try:
+                frame = next(frames)
+            except StopIteration:
+                return
+            if self.enabled:
+                self.record(name, time.perf_counter() - start, None, len(frame))
+            yield frame
+
+    def cprofile(self):
+        # cProfile whatever runs in the with block, if there's a --profile-dump file. only one thread is profiled at
+        # a time, so with several outputs built at once some of them aren't in the dump.
+        if self.cprofiler is None or not self.cprofile_lock.acquire(blocking=False):
+            return NullStageTimer()
+        return CProfileTimer(self)
+
+    def summary(self):
+        total = time.perf_counter() - self.start
+        lines = ["%-32s %6s %10s %6s %10s %10s %12s" % ("stage", "calls", "seconds", "%", "rows in", "rows out", "peak RSS MB")]
+        for stage in self.stages.values():
+            lines.append("%-32s %6d %10.3f %6.1f %10s %10s %12s" % (stage['stage'], stage['calls'], stage['seconds'], 100 * stage['seconds'] / total if total else 0,
+                "-" if stage['rows_in'] is None else stage['rows_in'], "-" if stage['rows_out'] is None else stage['rows_out'],
+                "-" if stage['peak_rss_mb'] is None else "%.1f" % stage['peak_rss_mb']))
+        lines.append("%-32s %6s %10.3f %6.1f %10s %10s %12s" % ("total", "", total, 100.0, "", "", "-" if resource is None else "%.1f" % peak_rss_mb()))
+        return "\n".join(lines)
+
+    def finish(self, trace_fname):
+        # prints the summary and writes the json trace (and the cProfile dump). does nothing without --profile.
+        if not self.enabled:
+            return
+        print(self.summary())
+        if self.cprofiler is not None:
+            self.cprofiler.dump_stats(self.cprofile_fname)
+            print("wrote cProfile dump of the conversion to " + self.cprofile_fname + " (python -m pstats " + self.cprofile_fname + ")")
+        trace = {
+                'argv': sys.argv,
+                'total_s': time.perf_counter() - self.start,
+                'peak_rss_mb': peak_rss_mb(),
+                'stages': list(self.stages.values()),
+                'cprofile': self.cprofile_fname,
+                }
+        with open(trace_fname, 'w') as f:
+            json.dump(trace, f, indent=1)
+        print("wrote profile trace to " + trace_fname)
+
+class StageTimer:
+    def __init__(self, profiler, name, rows_in):
+        self.profiler = profiler
+        self.name = name
+        self.stage = Stage(rows_in)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.stage.rows_in, self.stage.rows_out)
+        return False
+
+class CProfileTimer:
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler.cprofiler.enable()
+
+    def __exit__(self, *exc):
+        self.profiler.cprofiler.disable()
+        self.profiler.cprofile_lock.release()
+        return False
+
+class NullStageTimer:
+    def __enter__(self):
+        return Stage()
+
+    def __exit__(self, *exc):
+        return False
+
+# what the converters use when there's no --profile
+NULL_PROFILER = StageProfiler(enabled=False)
+
+def profile_trace_fname(outfile):
+    # next to the output: verde_TIMESTAMP.txt -> verde_TIMESTAMP.profile.json
+    return os.path.splitext(outfile)[0] + ".profile.json"
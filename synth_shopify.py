@@ -0,0 +1,134 @@
+import os
+import sys,getopt
+
+# every column, and the values of the ones we don't generate, come from a real export
+SCHEMA_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orders_to_1639.csv")
+
+# shopify only repeats these on every row of an order. everything else belongs to the order and is only on its first
+# row, which the converters fill down (see shopify_orders.py)
+LINE_ITEM_COLUMNS = ['Name', 'Vendor']
+LINE_ITEM_PREFIX = "Lineitem "
+# a blank cell, same as np.nan. pandas and numpy are only imported to generate an export, so bench_converters.py
+# can use parse_count() without them
+NAN = float('nan')
+# (value, weight) mixes. roughly what a month of real orders looks like, with a few more of the odd ones.
+line_skus = [
+        ('playpen-mat-balls-blue', 14), ('playpen-mat-balls-red', 8), ('playpen-mat-blue', 12), ('playpen-mat-red', 7),
+        ('playpen-blue', 12), ('playpen-red', 7), ('elite-play-mat-v2', 14), ('elite-play-mat', 4),
+        ('elite-play-mat-pitballs-100', 5), ('pitballs-100', 10), ('pitballs-200', 6), (NAN, 1), # gift cards and the like have no SKU
+        ]
+line_quantities = [(1, 85), (2, 11), (3, 4)]
+lines_per_order = [(1, 65), (2, 25), (3, 8), (4, 2)]
+financial_statuses = [('paid', 86), ('pending', 6), ('refunded', 4), ('partially_refunded', 2), ('voided', 2)]
+risk_levels = [('Low', 93), ('Medium', 5), ('High', 2)]
+shipping_address1s = [('811 Town and Country Blvd', 30), ('18 Bristlecone Drive', 25), ('4444 Amwood St.', 25), ('125 Paper Mill Road', 15),
+        ('PO Box 12', 2), ('P.O. Box 9', 1), ('Post Office Box 401', 1), ('12 Boxwood Ln', 1)] # the last one isn't a PO box, but looks like one to a careless check
+shipping_address2s = [(NAN, 80), ('Apt 4', 8), ('479', 6), ('Unit 2B', 4), ('PO Box 77', 2)]
+shipping_places = [(('Houston', 'TX', '77024'), 30), (('Howell Township', 'NJ', '07731'), 20), (('New Milford', 'CT', '06776'), 20),
+        (('Columbus', 'OH', '43228'), 20), ((' Leesburg ', 'VA', '20176'), 10)]
+shipping_names = [('Miguel  Mendoza ', 20), ('Adam Glielmi', 30), (' Amity LaFantano', 25), ('Ryan Emmons', 25)]
+# shopify keeps whatever the customer typed
+shipping_phones = [('8323880876', 40), ('(845) 590-7084', 20), ('1 (203) 942-5980', 15), ('937-232-5507', 15),
+        ('232-5507', 4), ('+1 937 232 5507', 3), (NAN, 3)]
+
+def print_help():
+    help_str=' python synth_shopify.py -n LINE_ITEMS -o FNAME_OUT [--seed=N] [--schema=FNAME_SHOPIFY] \n\
+            Writes a made up shopify export with LINE_ITEMS rows, to benchmark the converters with (see bench_converters.py).\n\
+            -n LINE_ITEMS  how many line items (rows), "k" and "m" suffixes work, e.g. -n 100k\n\
+            -o FNAME_OUT  (--out=FNAME_OUT) the .csv to write\n\
+            --seed=N  random seed (default 0). The same seed and size always give the same file\n\
+            --schema=FNAME_SHOPIFY  real export to copy the columns from (default orders_to_1639.csv)\n\n\
+            Orders have 1-4 line items on consecutive rows, with the order\'s own fields only on its first row like shopify does, and there are bundle SKUs, SKU-less lines, unpaid orders, risky orders, PO boxes, numeric Address2s and all sorts of phone formats.'
+    print(help_str)
+
+def parse_count(arg):
+    # "1000", "10k", "1m"
+    arg = arg.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(arg[-1:], 1)
+    return int(float(arg[:-1] if scale != 1 else arg) * scale)
+
+def pick(rng, choices, size):
+    import numpy as np
+    values, weights = zip(*choices)
+    picked = rng.choice(len(values), size=size, p=np.array(weights) / sum(weights))
+    return np.array(values + (None,), dtype=object)[:-1][picked]
+
+def synth_shopify(line_items, seed=0, schema_fname=SCHEMA_FNAME):
+    import pandas as pd
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    schema_pd = pd.read_csv(schema_fname, dtype=str, keep_default_na=False)
+
+    # lay the orders out first, then every order level column is picked once per order and repeated down its rows
+    sizes = pick(rng, lines_per_order, line_items).astype(int)
+    n_orders = int(np.searchsorted(np.cumsum(sizes), line_items)) + 1
+    order_of_row = np.repeat(np.arange(n_orders), sizes[:n_orders])[:line_items]
+    names = pd.Series(np.arange(n_orders) + 10000).astype(str).radd("PPE").to_numpy()
+
+    def per_order(choices):
+        return pick(rng, choices, n_orders)[order_of_row]
+
+    places = per_order(shipping_places)
+    address1 = per_order(shipping_address1s)
+    address2 = per_order(shipping_address2s)
+    shipping_name = per_order(shipping_names)
+    generated = {
+            'Name': names[order_of_row],
+            'Email': pd.Series(order_of_row).astype(str).radd("customer").add("@example.com").to_numpy(),
+            'Financial Status': per_order(financial_statuses),
+            'Lineitem quantity': pick(rng, line_quantities, line_items),
+            'Lineitem sku': pick(rng, line_skus, line_items),
+            'Billing Name': shipping_name,
+            'Shipping Name': shipping_name,
+            'Shipping Street': (pd.Series(address1) + (", " + pd.Series(address2)).fillna('')).to_numpy(),
+            'Shipping Address1': address1,
+            'Shipping Address2': address2,
+            'Shipping City': np.array([place[0] for place in places], dtype=object),
+            'Shipping Province': np.array([place[1] for place in places], dtype=object),
+            'Shipping Zip': np.array([place[2] for place in places], dtype=object),
+            'Shipping Country': 'US',
+            'Shipping Phone': per_order(shipping_phones),
+            'Risk Level': per_order(risk_levels),
+            }
+    # everything else is the first row of the real export, repeated
+    template_row = schema_pd.iloc[0]
+    synth_pd = pd.DataFrame({col: generated[col] if col in generated else template_row[col] for col in schema_pd.columns},
+            index=pd.RangeIndex(line_items))
+    # then the order's fields are blanked out on all but its first row, like in a real export
+    later_rows = np.r_[False, order_of_row[1:] == order_of_row[:-1]]
+    order_columns = [col for col in synth_pd.columns if col not in LINE_ITEM_COLUMNS and not col.startswith(LINE_ITEM_PREFIX)]
+    synth_pd.loc[later_rows, order_columns] = NAN
+    return synth_pd
+
+def process_args(opts, args):
+    line_items = None
+    out_fname = None
+    seed = 0
+    schema_fname = SCHEMA_FNAME
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+        elif opt == "-n":
+            line_items = parse_count(arg)
+        elif opt in ("-o", "--out"):
+            out_fname = arg
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--schema":
+            schema_fname = arg
+    return (line_items, out_fname, seed, schema_fname)
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv,"hn:o:",["out=","seed=","schema="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+    line_items, out_fname, seed, schema_fname = process_args(opts, args)
+    if line_items is None or out_fname is None:
+        print_help()
+        print("-n and -o are required")
+        sys.exit(2)
+    synth_shopify(line_items, seed, schema_fname).to_csv(out_fname, index=False)
+    print("wrote " + str(line_items) + " line items to " + out_fname)
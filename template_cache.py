@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+# local cache of things worked out from input files, next to the outputs
+CACHE_DIR = ".3pl_cache"
+TEMPLATE_CACHE_DIR = os.path.join(CACHE_DIR, "templates")
+# bump this if the schema format below changes, so old cache files are ignored
+SCHEMA_VERSION = 1
+
+def file_sha256(fname):
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def template_cache_fname(template_fname):
+    # keyed on where the template is, when it was last changed and what's in it
+    stat = os.stat(template_fname)
+    key = "%s|%d|%s|%d" % (os.path.abspath(template_fname), stat.st_mtime_ns, file_sha256(template_fname), SCHEMA_VERSION)
+    return os.path.join(TEMPLATE_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+def header_names(values):
+    # name the columns the way pd.read_excel does: trailing blanks are dropped, other blanks become
+    # "Unnamed: N" and repeated names get ".1", ".2", ... on the end
+    values = list(values)
+    while values and values[-1] is None:
+        values.pop()
+    names = []
+    seen = {}
+    for idx, value in enumerate(values):
+        name = "Unnamed: %d" % idx if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = "%s.%d" % (name, seen[name])
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def extract_template_schema(template_fname, header=1):
+    # the slow part: parse the whole workbook with openpyxl, only to get the headers out of it
+    from openpyxl import load_workbook
+    workbook = load_workbook(template_fname)
+    schema = {'sheet_names': workbook.sheetnames, 'sheets': {}}
+    for ws in workbook.worksheets:
+        rows = list(ws.iter_rows(values_only=True))
+        header_row = rows[header] if len(rows) > header else ()
+        schema['sheets'][ws.title] = {
+                'columns': header_names(header_row),
+                # cell range and title of each merged header above the column headers
+                'merged': [[str(cell_range), ws.cell(cell_range.min_row, cell_range.min_col).value] for cell_range in ws.merged_cells.ranges if cell_range.max_row <= header],
+                # templates normally have no rows of their own under the header
+                'data_rows': sum(1 for row in rows[header+1:] if any(value is not None for value in row)),
+                }
+    return schema
+
+def load_template_schema(template_fname, header=1):
+    # column order, sheet names and merged header ranges of an excel template. warm runs read them from a small
+    # json file in the cache instead of parsing the workbook.
+    cache_fname = template_cache_fname(template_fname)
+    if os.path.isfile(cache_fname):
+        with open(cache_fname) as f:
+            cached = json.load(f)
+        if cached.get('header') == header:
+            return cached['schema']
+    schema = extract_template_schema(template_fname, header)
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    # write then rename, so a run that dies half way can't leave a broken cache file behind
+    tmp_fname = cache_fname + ".tmp%d" % os.getpid()
+    with open(tmp_fname, 'w') as f:
+        json.dump({'template': os.path.abspath(template_fname), 'header': header, 'schema': schema}, f)
+    os.replace(tmp_fname, cache_fname)
+    return schema
+
+def template_frames(template_fname, sheet_name=0, header=1):
+    # stand-in for pd.read_excel(template_fname, sheet_name=sheet_name, header=header) on a template with no rows
+    # of its own: empty frames with the template's columns. sheet_name works like read_excel's (an index, a name
+    # or None for every sheet).
+    import pandas as pd
+    schema = load_template_schema(template_fname, header)
+    if sheet_name is None:
+        names = schema['sheet_names']
+    elif isinstance(sheet_name, int):
+        names = [schema['sheet_names'][sheet_name]]
+    else:
+        names = [sheet_name]
+    if any(schema['sheets'][name]['data_rows'] for name in names):
+        # a template with rows of its own needs the real thing
+        return pd.read_excel(open(template_fname, 'rb'), sheet_name=sheet_name, header=header)
+    frames = {name: pd.DataFrame(columns=schema['sheets'][name]['columns']) for name in names}
+    return frames if sheet_name is None else frames[names[0]]